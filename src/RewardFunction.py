@@ -1,5 +1,8 @@
 from abc import ABC, abstractmethod
 
+import numpy as np
+
+
 class RewardFunction(ABC):
     """
     Defines the basic structure of a reward function
@@ -25,21 +28,29 @@ class RewardR1(RewardFunction):
         super().__init__(system_state_converter, initial_reward)
 
     def update(self):
-        self.reward = len(self.system_state_converter.sink_store.items)
+        self.reward = self.system_state_converter.sink_store.total_completed
+
+    @classmethod
+    def relabel(cls, trace):
+        """
+        Rewards per tick of a recorded StatusTrace (the reward is the number of finished products)
+        :return: np.array of rewards per tick, reward_cases (None)
+        """
+        return np.diff(np.asarray(trace.completed), prepend=0).astype(float), None
 
 
 class RewardR2(RewardFunction):
     """ 
     Reward function for policy R2 
     """
+    c_cbm = 0.5 # scheduled repair
+    c_cm = 1.5 # corrective repair
+    c_pv = 0.1 # loss in each time step during repair
+
     def __init__(self, system_state_converter, initial_reward = 0):
         
         super().__init__(system_state_converter, initial_reward)
         
-        self.c_cbm = 0.5 # scheduled repair
-        self.c_cm = 1.5 # corrective repair
-        self.c_pv = 0.1 # loss in each time step during repair
-        
         self.reward_cases = {'idle': 0, 'idle_repair_necessary': 0, 'cm': 0, 'cbm': 0}
                 
     def update(self):
@@ -72,4 +83,87 @@ class RewardR2(RewardFunction):
                     self.reward_cases['cm'] += 1
                 # TODO: cost for repairing a machine that did not request repair?
         else:
-            raise Exception('Somehow found an unkown case in the actionbased reward calculation.')
\ No newline at end of file
+            raise Exception('Somehow found an unkown case in the actionbased reward calculation.')
+
+    @classmethod
+    def relabel(cls, trace, c_cbm=None, c_cm=None, c_pv=None):
+        """
+        Rewards per tick and reward_cases of a recorded StatusTrace with other costs (default: the costs of this class),
+        computed for all ticks at once like update()
+        :return: np.array of rewards per tick, reward_cases
+        """
+        c_cbm = cls.c_cbm if c_cbm is None else c_cbm
+        c_cm = cls.c_cm if c_cm is None else c_cm
+        c_pv = cls.c_pv if c_pv is None else c_pv
+
+        codes = np.asarray(trace.codes)
+        durations_cbm, durations_cm = np.asarray(trace.repair_durations, dtype=float).T
+        failed = (codes == StatusTrace.FAILED).sum(axis=1)
+        currently_repairing = (codes >= StatusTrace.REPAIR_CBM).sum(axis=1)
+
+        repair_costs = (codes == StatusTrace.REPAIR_CBM) @ (c_cbm/durations_cbm + c_pv/durations_cbm**2) \
+                     + (codes == StatusTrace.REPAIR_CM) @ (c_cm/durations_cm + c_pv/durations_cm**2)
+        rewards = np.where(currently_repairing > 0, -repair_costs, np.where(failed > 0, -(10 * c_cbm), 0.0))
+
+        reward_cases = {'idle': int(((failed == 0) & (currently_repairing == 0)).sum()),
+                        'idle_repair_necessary': int(((failed > 0) & (currently_repairing == 0)).sum()),
+                        'cm': int((codes == StatusTrace.REPAIR_CM).sum()),
+                        'cbm': int((codes == StatusTrace.REPAIR_CBM).sum())}
+        return rewards, reward_cases
+
+
+class StatusTrace():
+    """
+    Compact trace of an episode to compute the rewards again for other reward functions or costs (relabel() of
+    the reward functions): per tick the status of each machine as one code and the number of finished products,
+    and the ticks of the decisions (marks) to split the rewards into the rewards of the steps.
+    """
+    # status codes of a machine, repairs are the codes from REPAIR_CBM on
+    OTHER, FAILED, REPAIR_CBM, REPAIR_CM, REPAIR_OTHER = 0, 1, 2, 3, 4
+
+    def __init__(self, machines, get_parts_produced):
+        self.machines = machines
+        self.get_parts_produced = get_parts_produced
+        self.repair_durations = [(machine.repair_durations['cbm'], machine.repair_durations['cm']) for machine in machines]
+        self.codes = []
+        self.completed = []
+        self.marks = []
+
+    def _get_code(self, machine):
+        if machine.status == 'failed':
+            return self.FAILED
+        if machine.status in ['under_repair', 'repair_finished']:
+            if machine.repair_type == 'cbm':
+                return self.REPAIR_CBM
+            if machine.repair_type == 'cm':
+                return self.REPAIR_CM
+            return self.REPAIR_OTHER
+        return self.OTHER
+
+    def update(self):
+        """ records the current tick, supposed to be called with the update() of the reward function """
+        self.codes.append([self._get_code(machine) for machine in self.machines])
+        self.completed.append(self.get_parts_produced())
+
+    def mark(self):
+        """ marks a decision (or the end of the episode) after the recorded ticks """
+        self.marks.append(len(self.codes))
+
+    def step_rewards(self, rewards):
+        """ rewards per step as step() returns them (from the first decision on), from the rewards per tick """
+        cumulative = np.concatenate([[0.0], np.cumsum(rewards)])
+        return np.diff(cumulative[np.asarray(self.marks, dtype=np.int64)])
+
+    def save(self, path):
+        np.savez_compressed(path, codes=np.asarray(self.codes, dtype=np.uint8).reshape(-1, len(self.repair_durations)),
+            completed=np.asarray(self.completed, dtype=np.int64), marks=np.asarray(self.marks, dtype=np.int64),
+            repair_durations=np.asarray(self.repair_durations, dtype=np.int64))
+
+    @classmethod
+    def load(cls, path):
+        """ loads a saved trace, it can be relabeled but not recorded further """
+        trace = cls.__new__(cls)
+        with np.load(path) as data:
+            for name in ['codes', 'completed', 'marks', 'repair_durations']:
+                setattr(trace, name, data[name])
+        return trace
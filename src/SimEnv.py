@@ -11,7 +11,6 @@ class SimEnv(gym.Env, ABC):
     """ 
     Wrapper for simulation model as gym environment
     """
-    @classmethod
     @abstractmethod
     def __init__(self, system: System):
 
@@ -67,6 +66,14 @@ class SimEnv(gym.Env, ABC):
         observation = self.system_state_converter.system_state_to_observation()
         return observation
 
+    def get_parts_produced(self):
+        """ Returns the number of finished products """
+        return self.system.sink_store.total_completed
+
+    def get_kpis(self):
+        """ Returns the KPIs of the machines as arrays with one entry per machine, see MachineKPIs.as_arrays """
+        return self.system.kpis.as_arrays()
+
     def _get_info(self):
         """ Returns empty dict by default"""
         return {}
@@ -109,16 +116,13 @@ class SimEnv(gym.Env, ABC):
         else:
             active_simulation_time = self.system.simulation_time
            
-        # Parts produced depend on the amount of products in sink_store
+        # Parts produced are counted by the sink_store
         parts_produced, max_parts_possible, production_rate, lost_parts = {}, {}, {}, {}
         longest_task = self._get_bottleneck()
         self.logger.debug('Here are the longest process durations: {}'.format(longest_task), extra={'simtime': self.system.sim_env.now})
         # count all produced products
         for product_type in self.system.production_system.product_types:
-            parts_produced[product_type] = 0
-            for product in self.system.sink_store.items:
-                    if product.product_type == product_type:
-                        parts_produced[product_type] += 1
+            parts_produced[product_type] = self.system.sink_store.completed[product_type]
             max_parts_possible[product_type] = math.floor(active_simulation_time/longest_task[product_type])
             production_rate[product_type] =  round(100*(parts_produced[product_type]/max_parts_possible[product_type]))
             lost_parts[product_type] = max_parts_possible[product_type] - parts_produced[product_type]
@@ -1,25 +1,36 @@
 import gym
+import numpy as np
 from typing import Tuple
 
 from sim.System import System
+from sim.TickEnvironment import PHASE_DECISION
 from sim.SSC_IH import SimulationStateConverterIH
 from SimEnv import SimEnv
 
-from RewardFunction import RewardR1, RewardR2
+from RewardFunction import RewardR1, RewardR2, StatusTrace
 
 
 class SimEnvIH(SimEnv):
     """ 
     Wrapper for simulation model as gym environment
     """
-    def __init__(self, system: System):
+    def __init__(self, system: System, multi_crew=False, record_trace=False):
         super().__init__(system)
+        # record a StatusTrace of each episode (self.trace) to relabel its rewards later
+        self.record_trace = record_trace
+        self.trace = None
         
         # action, observation space
-        self.num_actions = len(self.system.machines)+1 # action: maintenance machine n; n+1: do nothing
-        self.action_space = gym.spaces.Discrete(self.num_actions)
+        # multi_crew: one action assigns all available maintenance crews at once, entry n = 1: maintenance machine n
+        self.multi_crew = multi_crew
+        if self.multi_crew:
+            self.num_actions = len(self.system.machines)
+            self.action_space = gym.spaces.MultiBinary(self.num_actions)
+        else:
+            self.num_actions = len(self.system.machines)+1 # action: maintenance machine n; n+1: do nothing
+            self.action_space = gym.spaces.Discrete(self.num_actions)
         
-        self.system_state_converter = SimulationStateConverterIH(self.system)
+        self.system_state_converter = self._get_state_converter()
         self.observation_space = self.system_state_converter.observation_space
 
         self.logger.debug("SimEnv_IH created \nAction_space: {} \nObservation space: {}"
@@ -38,9 +49,10 @@ class SimEnvIH(SimEnv):
         """
         # reset system, simulation state converter and reward function
         self.system.initialize()
-        self.system_state_converter = SimulationStateConverterIH(self.system)
+        self.system_state_converter = self._get_state_converter()
         self.reward_function = RewardR2(self.system_state_converter)
         #self.reward_function = RewardR1(self.system_state_converter)
+        self.trace = StatusTrace(self.system.machines, self.get_parts_produced) if self.record_trace else None
                 
         # reset variables
         self.done = False
@@ -59,11 +71,16 @@ class SimEnvIH(SimEnv):
           
         return initial_observation
 
+    def _get_state_converter(self):
+        """ Returns the SimulationStateConverter of the system """
+        return SimulationStateConverterIH(self.system)
+
     def step (self, action: object) -> Tuple[object, float, bool, dict]:  
         """
         Gym interface method: step
         Takes action and executes simulation until next action is needed
         :param action: int, represents maintenance machine n; n+1: do nothing
+            multi_crew: binary array, maintenance for every machine n with action[n] = 1; all 0: do nothing
         """
         
         # Reset required_maintenance variable
@@ -109,20 +126,133 @@ class SimEnvIH(SimEnv):
             
             # calculate reward/costs of this step
             self.reward_function.update()
+            if self.trace is not None:
+                self.trace.update()
+
+        if self.trace is not None:
+            self.trace.mark()
+
+    def run_episode(self, policy, observe=False):
+        """
+        Simulates a whole episode with a policy called directly inside the simulation at each decision point,
+        without the gym step loop (no observation, reward delta or info per decision)
+        :param policy: callable, policy(observation) -> action; observation is None unless observe is True
+        :param observe: bool, build the observation for the policy at each decision point
+        :return: float, total reward after the first decision point (the sum of the rewards step() would return)
+        """
+        # reset system, simulation state converter and reward function as in reset()
+        self.system.initialize()
+        self.system_state_converter = self._get_state_converter()
+        self.reward_function = RewardR2(self.system_state_converter)
+        #self.reward_function = RewardR1(self.system_state_converter)
+        self.trace = StatusTrace(self.system.machines, self.get_parts_produced) if self.record_trace else None
+
+        self.done = False
+        self.sim_counter = 1
+        self.maintenance_requested = False
+        self.previous_reward = None
+        self.logger.debug("Reset done", extra = {"simtime": self.system.sim_env.now})
+
+        decider = self.system.sim_env.process(self._decide(policy, observe))
+        self.system.sim_env.run(until=decider)
+
+        if self.previous_reward is None:
+            self.previous_reward = self.reward_function.reward
+        self._log_summary()
+        return self.reward_function.reward - self.previous_reward
+
+    def _decide(self, policy, observe):
+        """
+        simpy process of run_episode: does the bookkeeping of next_sim_step at the start of each tick, i.e. after
+        the repair phase of the previous one, and calls the policy when maintenance is available and required
+        """
+        while True:
+            yield self.system.sim_env.timeout_phase(1, PHASE_DECISION)
+            self.sim_counter = self.system.sim_env.now + 1
+
+            for machine in self.system.machines:
+                if machine.request_maintenance:
+                    self.maintenance_requested = True
+            self.reward_function.update()
+            if self.trace is not None:
+                self.trace.update()
+
+            self.done = self._check_if_model_is_done()
+            if self.done:
+                if self.trace is not None:
+                    self.trace.mark()
+                return
+
+            if self.system.available_maintenance > 0 and self.maintenance_requested:
+                if self.previous_reward is None:
+                    self.previous_reward = self.reward_function.reward
+                if self.trace is not None:
+                    self.trace.mark()
+                self.maintenance_requested = False
+                observation = self._get_observation() if observe else None
+                self.execute_action(policy(observation))
 
     def execute_action(self, action):
         """
         Executes the agents action in the factory simulation
         :param action: int,  numerival value of action chosen by the agent
+            multi_crew: binary array, one entry per machine
         """
         
+        mask = self.get_action_mask()
+        if self.multi_crew:
+            machines = [machine for machine, maintain, valid in zip(self.system.machines, action, mask) if maintain and valid]
+            if len(machines) < sum(1 for maintain in action if maintain):
+                self.logger.debug("Action contains invalid maintenance, ignoring it", extra = {"simtime": self.system.sim_env.now})
+            if len(machines) == 0:
+                self.logger.debug("Action Idle chosen", extra = {"simtime": self.system.sim_env.now})
+            # each machine needs one of the available crews, machines beyond the capacity are ignored
+            if len(machines) > self.system.available_maintenance:
+                self.logger.debug("Action exceeds maintenance capacity, ignoring {}".format([machine.id for machine in machines[self.system.available_maintenance:]]),
+                    extra = {"simtime": self.system.sim_env.now})
+                machines = machines[:max(0, self.system.available_maintenance)]
+            for machine in machines:
+                self.maintain_machine(machine)
+            return
+
         if action == self.action_space.n-1:
             self.logger.debug("Action Idle chosen", extra = {"simtime": self.system.sim_env.now})
             return
+
+        # maintenance of a machine that did not request it, is already being repaired or without a free crew is ignored
+        if not mask[action]:
+            self.logger.debug("Invalid action {} chosen, ignoring it".format(action), extra = {"simtime": self.system.sim_env.now})
+            return
         
         # select machine based on action
-        machine = self.system.machines[action]
+        self.maintain_machine(self.system.machines[action])
 
+    def get_action_mask(self):
+        """
+        Returns which actions are valid: maintenance of machine n if it requested maintenance, is not yet
+        being repaired and a maintenance crew is available; idle is always valid
+        :return: np.array of bool, one entry per action (multi_crew: per machine)
+        """
+        mask = np.zeros(self.action_space.n, dtype=bool)
+        if self.system.available_maintenance > 0:
+            for n, machine in enumerate(self.system.machines):
+                mask[n] = machine.request_maintenance and machine.status not in ['under_repair', 'scheduled_maintenance']
+        if not self.multi_crew:
+            mask[-1] = True
+        return mask
+
+    def _get_info(self):
+        """ Returns the action mask for the next decision, at the end of the episode also the KPIs of the machines """
+        info = {'action_mask': self.get_action_mask()}
+        if self._check_if_model_is_done():
+            info['kpis'] = self.get_kpis()
+        return info
+
+    def maintain_machine(self, machine):
+        """
+        Assigns a maintenance crew to the machine
+        :param machine: Machine, machine chosen by the agent
+        """
         self.logger.debug("Action Maintain {} choosen".format(machine.id), extra = {"simtime": self.system.sim_env.now})
         
         # Differentiation necessary if interruption due to degrading or CBM
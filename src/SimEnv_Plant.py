@@ -0,0 +1,40 @@
+import numpy as np
+
+from sim.Plant import Plant
+from sim.SSC_Plant import SimulationStateConverterPlant
+from SimEnv_IH import SimEnvIH
+
+
+class SimEnvPlant(SimEnvIH):
+    """
+    Maintenance planning of a Plant as gym environment: same actions and rewards as SimEnvIH over the machines
+    of all lines (machine n of the plant is plant.machines[n]), decision points whenever a machine of any line
+    requested maintenance and a maintenance resource of the plant is available.
+    With many lines, use multi_crew to assign all available resources in one step.
+    """
+    def __init__(self, plant: Plant, multi_crew=False, record_trace=False):
+        super().__init__(plant, multi_crew=multi_crew, record_trace=record_trace)
+
+    def _get_state_converter(self):
+        """ Returns the SimulationStateConverter of the plant """
+        return SimulationStateConverterPlant(self.system)
+
+    def get_parts_produced(self):
+        """ Returns the number of finished products of all lines """
+        return self.system.get_parts_produced()
+
+    def get_kpis(self):
+        """ Returns the KPIs of the machines of all lines, in the order of plant.machines """
+        kpis = [line.kpis.as_arrays() for line in self.system.lines]
+        return {name: np.concatenate([line_kpis[name] for line_kpis in kpis]) for name in kpis[0]}
+
+    def _log_summary(self):
+        """ Log final summary """
+        parts_produced = [line.sink_store.total_completed for line in self.system.lines]
+        msg = "\n\
+            Total Reward: {reward}\n\
+            Parts Produced: {pp} (per line: {ppl})\n\
+            reward/cost cases: {cc}"\
+                    .format(reward=self.reward_function.reward, pp=sum(parts_produced), ppl=parts_produced,
+                            cc = self.reward_function.reward_cases)
+        self.logger.info(msg ,extra = {"simtime": self.system.sim_env.now})
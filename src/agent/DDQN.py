@@ -1,14 +1,20 @@
+import os
 import random
 import math
 from collections import namedtuple
 
 import numpy as np
+import gym
 import torch
 import torch.nn as nn
 import torch.optim as optim
 import torch.nn.functional as F
 
 
+# experience tuple stored in the Experience Replay (module level to be picklable for checkpoints)
+# next_mask: valid actions in next_state (None: all actions valid)
+Experience = namedtuple('Experience', ('state', 'action', 'next_state', 'reward', 'done', 'next_mask'), defaults=(None,))
+
 class DQNModel(nn.Module):
     """
     Deep Q-Network Neural Network
@@ -37,6 +43,24 @@ class DQNModel(nn.Module):
         return t
 
 
+class FactoredDQNModel(DQNModel):
+    """
+    Deep Q-Network with a factored output layer for MultiBinary actions: one branch per machine
+    with one Q-Value per sub-action (0: no maintenance, 1: maintenance), the hidden layers are shared
+    """
+    def __init__(self, n_branches, env_dims, n_hidden1=14, n_hidden2=28, n_sub_actions=2):
+        super().__init__(n_actions=n_branches*n_sub_actions, env_dims=env_dims, n_hidden1=n_hidden1, n_hidden2=n_hidden2)
+        self.n_branches = n_branches
+        self.n_sub_actions = n_sub_actions
+
+    def forward(self, t):
+        """
+        Feedforward state through neural network, returns Q-Values of shape (batch, n_branches, n_sub_actions)
+        """
+        t = super().forward(t)
+        return t.view(-1, self.n_branches, self.n_sub_actions)
+
+
 class ReplayMemory():
     """
     Experience Replay to store the experiences of the agent
@@ -72,6 +96,123 @@ class ReplayMemory():
         """
         return self.memory_counter >= batch_size
 
+    def sample_batch(self, batch_size):
+        """
+        Sample experiences and stack them to tensors (states, actions, next_states, rewards, dones, next_masks),
+        experiences without a mask allow all actions, next_masks is None if no experience has a mask
+        """
+        experiences = self.sample(batch_size)
+        states, actions, next_states, rewards, dones, next_masks = zip(*experiences)
+        shape = next((mask.shape for mask in next_masks if mask is not None), None)
+        if shape is not None:
+            next_masks = torch.cat([torch.ones(shape, dtype=torch.bool) if mask is None else mask for mask in next_masks])
+        else:
+            next_masks = None
+        return torch.cat(states), torch.cat(actions), torch.cat(next_states), torch.cat(rewards), torch.cat(dones), next_masks
+
+    def state_dict(self):
+        """
+        Returns the content of the Experience Replay for checkpointing
+        """
+        return {'memory': self.memory, 'memory_counter': self.memory_counter}
+
+    def load_state_dict(self, state_dict):
+        """
+        Restores the Experience Replay from a checkpoint
+        """
+        self.memory = state_dict['memory']
+        self.memory_counter = state_dict['memory_counter']
+
+
+class MemmapReplayMemory():
+    """
+    Experience Replay stored in memory-mapped files, allows capacities beyond RAM and keeps
+    the experiences on disk when training is interrupted
+    """
+    def __init__(self, capacity, state_dims, path, action_dims=1, mask_dims=None):
+        # Capacity of the Experience Replay
+        self.capacity = capacity
+        self.state_dims = state_dims
+        self.action_dims = action_dims
+        self.mask_dims = mask_dims
+        self.path = path
+        os.makedirs(self.path, exist_ok=True)
+
+        # one file per field of an experience, reuse existing files to continue an interrupted training
+        self.states = self._open_memmap('states', np.float32, (self.capacity, self.state_dims))
+        # MultiBinary actions are stored as one row per experience
+        self.actions = self._open_memmap('actions', np.int64, (self.capacity,) if self.action_dims == 1 else (self.capacity, self.action_dims))
+        self.next_states = self._open_memmap('next_states', np.float32, (self.capacity, self.state_dims))
+        self.rewards = self._open_memmap('rewards', np.float32, (self.capacity,))
+        self.dones = self._open_memmap('dones', np.int32, (self.capacity,))
+        # valid actions in the next states, only if mask_dims is given
+        self.next_masks = None if self.mask_dims is None else self._open_memmap('next_masks', np.bool_, (self.capacity, self.mask_dims))
+        self.memory_counter = 0
+
+    def _open_memmap(self, name, dtype, shape):
+        """
+        Opens the file for one field of the experiences, creates it if it does not exist yet
+        """
+        filename = os.path.join(self.path, name + '.dat')
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        if os.path.exists(filename) and os.path.getsize(filename) == size:
+            return np.memmap(filename, dtype=dtype, mode='r+', shape=shape)
+        return np.memmap(filename, dtype=dtype, mode='w+', shape=shape)
+
+    def store(self, experience):
+        """
+        Save experience to Experience Replay
+        """
+        index = self.memory_counter % self.capacity
+        self.states[index] = experience.state.numpy()
+        self.actions[index] = experience.action.numpy().reshape(self.actions.shape[1:])
+        self.next_states[index] = experience.next_state.numpy()
+        self.rewards[index] = experience.reward.item()
+        self.dones[index] = experience.done.item()
+        if self.next_masks is not None:
+            self.next_masks[index] = True if experience.next_mask is None else experience.next_mask.numpy()
+        self.memory_counter += 1
+
+    def sample_batch(self, batch_size):
+        """
+        Sample experiences and return them as tensors (states, actions, next_states, rewards, dones, next_masks)
+        """
+        # sorted indices to read the files as sequentially as possible
+        indices = sorted(random.sample(range(min(self.memory_counter, self.capacity)), batch_size))
+        return (torch.from_numpy(self.states[indices]),
+                torch.from_numpy(self.actions[indices]),
+                torch.from_numpy(self.next_states[indices]),
+                torch.from_numpy(self.rewards[indices]),
+                torch.from_numpy(self.dones[indices]),
+                None if self.next_masks is None else torch.from_numpy(self.next_masks[indices]))
+
+    def sample_possible(self, batch_size):
+        """
+        Check if sampling from memory is possible
+        """
+        return self.memory_counter >= batch_size
+
+    def flush(self):
+        """
+        Write all experiences to disk
+        """
+        for memmap in (self.states, self.actions, self.next_states, self.rewards, self.dones, self.next_masks):
+            if memmap is not None:
+                memmap.flush()
+
+    def state_dict(self):
+        """
+        Returns the head pointer of the Experience Replay for checkpointing, experiences themselves stay in the files
+        """
+        self.flush()
+        return {'memory_counter': self.memory_counter}
+
+    def load_state_dict(self, state_dict):
+        """
+        Restores the head pointer of the Experience Replay from a checkpoint
+        """
+        self.memory_counter = state_dict['memory_counter']
+
 
 class EpsilonGreedy():
     """
@@ -97,7 +238,7 @@ class DDQNAgent():
     Double-DQN RL Agent
     """
     def __init__(self, env, model, target_model, lr, buffer_sz, epsilon, epsilon_decay, 
-    min_epsilon, gamma, target_update_iter, start_learning):
+    min_epsilon, gamma, target_update_iter, start_learning, replay_path=None):
         self.env = env
         self.model = model
         self.target_model = target_model
@@ -112,9 +253,16 @@ class DDQNAgent():
 
         self.optimizer = optim.Adam(params=model.parameters(), lr=self.lr)
         self.strategy = EpsilonGreedy(self.epsilon , self.min_epsilon, self.epsilon_decay)
-        self.memory = ReplayMemory(self.buffer_sz)
+        # MultiBinary actions (one step assigns all maintenance crews) need a FactoredDQNModel
+        self.factored = isinstance(self.env.action_space, gym.spaces.MultiBinary)
+        # keep the Experience Replay in memory-mapped files if a path is given
+        if replay_path is None:
+            self.memory = ReplayMemory(self.buffer_sz)
+        else:
+            self.memory = MemmapReplayMemory(self.buffer_sz, self.env.system_state_converter.get_observation_dims(), replay_path,
+                action_dims=self.env.action_space.n if self.factored else 1, mask_dims=self.env.action_space.n)
         # create a experience tuple
-        self.experience = namedtuple('Experience', ('state', 'action', 'next_state', 'reward', 'done'))
+        self.experience = Experience
         self.num_actions = self.env.action_space.n
 
         # copy weights from model to target_model
@@ -124,7 +272,11 @@ class DDQNAgent():
 
         self.current_step = 0
 
-    def train(self, epochs, batch_sz):
+    def train(self, epochs, batch_sz, checkpoint_path=None, checkpoint_iter=100):
+        """
+        Trains the agent for the given number of epochs. If checkpoint_path is given, the training state is saved
+        every checkpoint_iter epochs and an existing checkpoint is resumed.
+        """
 
         # training loop
         ep_rewards = [0.0]
@@ -134,15 +286,21 @@ class DDQNAgent():
         produced_parts = []
         ep_rewards_mean = []
 
-        for epoch in range(epochs):
+        start_epoch = 0
+        if checkpoint_path is not None and os.path.exists(checkpoint_path):
+            start_epoch, ep_rewards, ep_steps, produced_parts, ep_rewards_mean = self.load_checkpoint(checkpoint_path)
+
+        for epoch in range(start_epoch, epochs):
 
             state = self.env.reset()
             state = torch.FloatTensor([state]) # convert state to tensor
+            mask = self.env.get_action_mask()
 
             while True:
-                # select action according to e-greedy strategy
-                action = self._select_action(state)
-                next_state, reward, done, _ = self.env.step(action)
+                # select action according to e-greedy strategy, among the valid actions
+                action = self._select_action(state, mask)
+                next_state, reward, done, info = self.env.step(action)
+                next_mask = info['action_mask']
 
                 ep_rewards[-1] += reward
                 ep_steps[-1] += 1
@@ -152,52 +310,20 @@ class DDQNAgent():
                 reward = torch.FloatTensor([reward])
                 action = torch.tensor([action], dtype=torch.int64)
                 done = torch.tensor([done], dtype=torch.int32)
-                self.memory.store(self.experience(state, action, next_state, reward, done))
+                self.memory.store(self.experience(state, action, next_state, reward, done, torch.from_numpy(next_mask).unsqueeze(0)))
 
                 # training of DQN model
                 if self.memory.sample_possible(batch_sz):
-                    # choose random experience from Replay Memory
-                    experiences = self.memory.sample(batch_sz)
-                    # separate states, actions, rewards and next_states from the minibatch
-                    states, actions, next_states, rewards, dones = zip(*experiences)
-                    states = torch.cat(states)
-                    actions = torch.cat(actions)
-                    rewards = torch.cat(rewards)
-                    next_states = torch.cat(next_states)
-                    dones = torch.cat(dones)
-
-                    # Input states of minibatch into model --> Get current Q-Value estimation of model
-                    index = actions.unsqueeze(-1) # transforms actions tensor into tensor with lists for indexing
-                    current_q_values = self.model(states).gather(dim=1, index=index).squeeze() # squeeze to remove 1 axis
-
-                    # DDQN
-                    max_next_q_values_model_indices = self.model(next_states).argmax(1).detach()
-                    index_ddqn = max_next_q_values_model_indices.unsqueeze(-1)
-                    # Gather Q-Values of target_model for corresponding actions
-                    next_q_values_from_target_of_model_indices = self.target_model(next_states).gather(dim=1,index=index_ddqn).squeeze() # squeeze to remove 1 axis
-                    # Update target Q_values with Q-values of target_model based on max Q-values of model
-                    target_q_values = (next_q_values_from_target_of_model_indices*self.gamma)+rewards*(1-dones)
-                    
-                    # Calculate loss
-                    loss = F.mse_loss(current_q_values, target_q_values)
-
-                    # Set the gradients to zero before starting to do backpropragation with loss
-                    self.optimizer.zero_grad()
-                    loss.backward()
-                    # clip the gradients 
-                    clip=1
-                    nn.utils.clip_grad_norm_(self.model.parameters(),clip)
-                    
-                    # update params
-                    self.optimizer.step()
+                    self._optimize_model(batch_sz)
 
                 state = next_state
+                mask = next_mask
                 # Logging and update of target_model
                 if done:
 
                     ep_rewards.append(0.0)
                     ep_steps.append(0)
-                    produced_parts.append(len(self.env.system.sink_store.items))
+                    produced_parts.append(self.env.get_parts_produced())
                     ep_rewards_mean.append(self._get_mean_reward(ep_rewards))
 
                     print('epoch:', epoch)
@@ -207,26 +333,221 @@ class DDQNAgent():
             if epoch % self.target_update_iter == 0 and epoch != 0:
                 self.target_model.load_state_dict(self.model.state_dict())
 
+            # save the training state to be able to resume an interrupted training
+            if checkpoint_path is not None and ((epoch + 1) % checkpoint_iter == 0 or epoch == epochs - 1):
+                self.save_checkpoint(checkpoint_path, epoch + 1, ep_rewards, ep_steps, produced_parts, ep_rewards_mean)
+
         ep_rewards = ep_rewards[:-1]
 
         return ep_rewards, produced_parts, ep_rewards_mean
 
-    def _select_action(self, state):
+    def prefill(self, dataset, n=None):
+        """
+        Stores recorded experiences (TrajectoryDataset) in the Replay Memory, the last n (default: as many as fit),
+        with their action masks if they were recorded
+        """
+        n = min(len(dataset), n or self.buffer_sz, self.buffer_sz)
+        for index in range(len(dataset) - n, len(dataset)):
+            next_mask = None if dataset.next_masks is None else torch.from_numpy(dataset.next_masks[index:index+1].copy())
+            self.memory.store(self.experience(torch.from_numpy(dataset.states[index:index+1].copy()),
+                                              torch.from_numpy(dataset.actions[index:index+1].copy()),
+                                              torch.from_numpy(dataset.next_states[index:index+1].copy()),
+                                              torch.from_numpy(dataset.rewards[index:index+1].copy()),
+                                              torch.from_numpy(dataset.dones[index:index+1].copy()),
+                                              next_mask))
+
+    def train_offline(self, dataset, updates, batch_sz, target_update_steps=1000):
+        """
+        Trains the model on recorded experiences (TrajectoryDataset) only, without interacting with the environment
+        :param updates: number of gradient steps
+        :param target_update_steps: gradient steps between two copies of the weights to the target_model
+        """
+        assert dataset.sample_possible(batch_sz), 'Tried to train offline with batch size {} on {} experiences.'.format(batch_sz, len(dataset))
+        for update in range(1, updates+1):
+            self._optimize_model(batch_sz, memory=dataset)
+            if update % target_update_steps == 0:
+                self.target_model.load_state_dict(self.model.state_dict())
+
+    def _optimize_model(self, batch_sz, memory=None):
+        """
+        Performs one gradient step of the model on a minibatch from the Replay Memory (or the given memory)
+        """
+        if memory is None:
+            memory = self.memory
+        # choose random experience from Replay Memory, separated in states, actions, rewards and next_states
+        states, actions, next_states, rewards, dones, next_masks = memory.sample_batch(batch_sz)
+
+        if self.factored:
+            loss = self._get_factored_loss(states, actions, next_states, rewards, dones, next_masks)
+        else:
+            loss = self._get_loss(states, actions, next_states, rewards, dones, next_masks)
+
+        # Set the gradients to zero before starting to do backpropragation with loss
+        self.optimizer.zero_grad()
+        loss.backward()
+        # clip the gradients 
+        clip=1
+        nn.utils.clip_grad_norm_(self.model.parameters(),clip)
+        
+        # update params
+        self.optimizer.step()
+
+    def _get_loss(self, states, actions, next_states, rewards, dones, next_masks=None):
+        """
+        DDQN loss for Discrete actions, the next actions are chosen among the valid ones (next_masks)
+        """
+        # Input states of minibatch into model --> Get current Q-Value estimation of model
+        index = actions.unsqueeze(-1) # transforms actions tensor into tensor with lists for indexing
+        current_q_values = self.model(states).gather(dim=1, index=index).squeeze() # squeeze to remove 1 axis
+
+        # DDQN
+        next_q_values_model = self.model(next_states)
+        if next_masks is not None:
+            next_q_values_model = next_q_values_model.masked_fill(~next_masks, -float('inf'))
+        max_next_q_values_model_indices = next_q_values_model.argmax(1).detach()
+        index_ddqn = max_next_q_values_model_indices.unsqueeze(-1)
+        # Gather Q-Values of target_model for corresponding actions
+        next_q_values_from_target_of_model_indices = self.target_model(next_states).gather(dim=1,index=index_ddqn).squeeze() # squeeze to remove 1 axis
+        # Update target Q_values with Q-values of target_model based on max Q-values of model
+        target_q_values = (next_q_values_from_target_of_model_indices*self.gamma)+rewards*(1-dones)
+        
+        # Calculate loss
+        return F.mse_loss(current_q_values, target_q_values)
+
+    def _get_factored_loss(self, states, actions, next_states, rewards, dones, next_masks=None):
         """
-        Select action depending on exploration strategie (eps-greedy)
+        DDQN loss for MultiBinary actions, each branch is updated towards a common target
+        with the mean over the branches of the next Q-Values (as in Branching Dueling Q-Networks),
+        maintenance is only chosen for machines where it is valid (next_masks)
+        """
+        # Q-Values of the chosen sub-action of each branch, shape (batch, n_branches)
+        current_q_values = self.model(states).gather(dim=2, index=actions.unsqueeze(-1)).squeeze(-1)
+
+        # DDQN per branch: sub-actions chosen by model, evaluated by target_model
+        next_q_values_model = self.model(next_states)
+        if next_masks is not None:
+            next_q_values_model = self._mask_factored(next_q_values_model, next_masks)
+        index_ddqn = next_q_values_model.argmax(2).detach().unsqueeze(-1)
+        next_q_values_from_target_of_model_indices = self.target_model(next_states).gather(dim=2, index=index_ddqn).squeeze(-1).mean(dim=1)
+        target_q_values = (next_q_values_from_target_of_model_indices*self.gamma)+rewards*(1-dones)
+
+        # Calculate loss
+        return F.mse_loss(current_q_values, target_q_values.unsqueeze(-1).expand_as(current_q_values))
+
+    def save_checkpoint(self, path, epoch, ep_rewards, ep_steps, produced_parts, ep_rewards_mean):
+        """
+        Saves everything needed to resume the training: model, target_model, optimizer, exploration schedule,
+        random number generators, Replay Memory (or its head pointer) and the training history.
+        Supposed to be called between two episodes.
+        """
+        checkpoint = {
+            'epoch': epoch,
+            'model': self.model.state_dict(),
+            'target_model': self.target_model.state_dict(),
+            'optimizer': self.optimizer.state_dict(),
+            'current_step': self.current_step,
+            'memory': self.memory.state_dict(),
+            'random_state': random.getstate(),
+            'numpy_random_state': np.random.get_state(),
+            'torch_random_state': torch.get_rng_state(),
+            # the action space carries the random number generator used for exploration
+            'action_space_random_state': self._action_space_rng_state(),
+            'history': (ep_rewards, ep_steps, produced_parts, ep_rewards_mean),
+            }
+        # write to a temporary file first to not corrupt the last checkpoint if the process dies while saving
+        torch.save(checkpoint, path + '.tmp')
+        os.replace(path + '.tmp', path)
+
+    def load_checkpoint(self, path):
+        """
+        Restores the training state saved by save_checkpoint
+        :return: epoch to continue with and the training history (ep_rewards, ep_steps, produced_parts, ep_rewards_mean)
+        """
+        checkpoint = torch.load(path, weights_only=False)
+        self.model.load_state_dict(checkpoint['model'])
+        self.target_model.load_state_dict(checkpoint['target_model'])
+        self.optimizer.load_state_dict(checkpoint['optimizer'])
+        self.current_step = checkpoint['current_step']
+        self.memory.load_state_dict(checkpoint['memory'])
+        random.setstate(checkpoint['random_state'])
+        np.random.set_state(checkpoint['numpy_random_state'])
+        torch.set_rng_state(checkpoint['torch_random_state'])
+        self._action_space_rng_state(checkpoint['action_space_random_state'])
+        return (checkpoint['epoch'],) + tuple(checkpoint['history'])
+
+    def _action_space_rng_state(self, state=None):
+        """ returns the state of the random number generator of the action space, sets it if a state is given """
+        rng = self.env.action_space.np_random
+        # gym < 0.22 uses a RandomState, later versions a Generator
+        if isinstance(rng, np.random.RandomState):
+            if state is not None:
+                rng.set_state(state)
+            return rng.get_state()
+        if state is not None:
+            rng.bit_generator.state = state
+        return rng.bit_generator.state
+
+    def _select_action(self, state, mask=None):
+        """
+        Select action depending on exploration strategie (eps-greedy), among the valid actions if a mask is given
         """  
         self.exploration_rate = self.strategy.get_exploration_rate(self.current_step)
         self.current_step +=1
         
+        if self.factored:
+            return self._select_factored_action(state, mask)
+
         if self.exploration_rate > random.random():
-            action = self.env.action_space.sample()
+            if mask is None:
+                action = self.env.action_space.sample()
+            else:
+                action = int(self.env.action_space.np_random.choice(np.flatnonzero(mask)))
             return action  # agent explores
         else:
             # Turn off gradient tracking since we’re currently using the model for inference and not training.
             with torch.no_grad():
-                action = self.model(state).argmax(dim=1).item()
+                q_values = self.model(state)
+                if mask is not None:
+                    q_values = q_values.masked_fill(~torch.from_numpy(mask), -float('inf'))
+                action = q_values.argmax(dim=1).item()
                 return action #  agent exploits
 
+    def _select_factored_action(self, state, mask=None):
+        """
+        Select MultiBinary action depending on exploration strategie (eps-greedy), at most as many machines
+        as maintenance resources are available are chosen, only machines where maintenance is valid if a mask is given
+        """
+        if self.exploration_rate > random.random():
+            action = self.env.action_space.sample()
+            if mask is not None:
+                action = action * mask
+            # keep a random subset of the chosen machines
+            priorities = np.random.random(len(action))
+        else:
+            with torch.no_grad():
+                q_values = self.model(state)
+                if mask is not None:
+                    q_values = self._mask_factored(q_values, torch.from_numpy(mask).unsqueeze(0))
+                q_values = q_values[0]
+            action = q_values.argmax(dim=1).numpy().astype(self.env.action_space.dtype)
+            # keep the machines with the highest advantage of maintenance
+            priorities = (q_values[:, 1] - q_values[:, 0]).numpy()
+
+        chosen = np.flatnonzero(action)
+        capacity = max(0, self.env.system.available_maintenance)
+        if len(chosen) > capacity:
+            action[chosen[np.argsort(-priorities[chosen])[capacity:]]] = 0
+        return action
+
+    def _mask_factored(self, q_values, masks):
+        """
+        Sets the Q-Values of maintenance (sub-action 1) to -inf for machines where it is not valid,
+        q_values of shape (batch, n_branches, 2), masks of shape (batch, n_branches)
+        """
+        q_values = q_values.clone()
+        q_values[..., 1] = q_values[..., 1].masked_fill(~masks, -float('inf'))
+        return q_values
+
     def _get_mean_reward(self, ep_rewards):
         """ mean reward over 100 episodes"""
         if len(ep_rewards) <= 100:
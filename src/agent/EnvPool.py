@@ -0,0 +1,101 @@
+import asyncio
+
+import numpy as np
+
+
+def greedy_policy(model):
+    """
+    Batched policy of a DQNModel for AsyncEnvPool: the action with the highest Q-Value among the valid actions
+    """
+    import torch
+    model.eval()
+
+    def policy(observations, masks):
+        with torch.no_grad():
+            q_values = model(torch.from_numpy(observations))
+            q_values = q_values.masked_fill(~torch.from_numpy(masks), -float('inf'))
+        return q_values.argmax(dim=1).tolist()
+    return policy
+
+
+class AsyncEnvPool():
+    """
+    Runs many SimEnvIH in one process as asyncio tasks: each env simulates until its next decision and waits there,
+    once all running envs wait, their observations and action masks are evaluated with one call of the batched policy
+    policy(observations (batch, dims) float32, masks (batch, n_actions) bool) -> actions, e.g. greedy_policy(model),
+    and the envs continue with their actions. The simulations themselves run one after the other (no threads).
+    """
+    def __init__(self, envs, policy, on_step=None):
+        """
+        :param on_step: optional callable on_step(n, state, action, reward, next_state, done, info) after each step of env n,
+            e.g. to store the experiences in a ReplayMemory
+        """
+        self.envs = envs
+        self.policy = policy
+        self.on_step = on_step
+
+        self.pending = []
+        self.running = 0
+
+        # statistics
+        self.decisions = 0
+        self.batches = 0
+
+    def run(self, episodes):
+        """
+        Runs the given number of episodes in each env
+        :return: per env the rewards and the produced parts of its episodes
+        """
+        return asyncio.run(self._run(episodes))
+
+    async def _run(self, episodes):
+        self.running = len(self.envs)
+        return await asyncio.gather(*(self._run_env(n, env, episodes) for n, env in enumerate(self.envs)))
+
+    async def _run_env(self, n, env, episodes):
+        """ episodes of one env, waits for the batched policy at each decision """
+        ep_rewards, produced_parts = [], []
+        try:
+            for episode in range(episodes):
+                state = env.reset()
+                mask = env.get_action_mask()
+                ep_rewards.append(0.0)
+                done = False
+                while not done:
+                    action = await self._get_action(state, mask)
+                    next_state, reward, done, info = env.step(action)
+                    ep_rewards[-1] += reward
+                    if self.on_step is not None:
+                        self.on_step(n, state, action, reward, next_state, done, info)
+                    state, mask = next_state, info['action_mask']
+                produced_parts.append(env.get_parts_produced())
+        finally:
+            # the other envs do not wait for this one anymore
+            self.running -= 1
+            if self.pending and len(self.pending) >= self.running:
+                self._evaluate()
+        return ep_rewards, produced_parts
+
+    async def _get_action(self, state, mask):
+        """ waits until all running envs wait for an action, the last one evaluates the batch """
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((state, mask, future))
+        if len(self.pending) >= self.running:
+            self._evaluate()
+        return await future
+
+    def _evaluate(self):
+        """ evaluates the policy for all waiting envs and resumes them """
+        pending, self.pending = self.pending, []
+        states, masks, futures = zip(*pending)
+        try:
+            actions = self.policy(np.asarray(states, dtype=np.float32), np.asarray(masks, dtype=bool))
+        except Exception as exception:
+            # all waiting envs fail, otherwise they would wait forever
+            for future in futures:
+                future.set_exception(exception)
+            return
+        for action, future in zip(actions, futures):
+            future.set_result(action)
+        self.decisions += len(pending)
+        self.batches += 1
@@ -0,0 +1,139 @@
+import os
+import json
+import glob
+import hashlib
+import inspect
+import logging
+
+
+SRC = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# parameters of a System that change the simulation (besides its ProductionSystem)
+SYSTEM_PARAMETERS = ('use_case', 'maintenance_capacity', 'maintenance_priority', 'cbm_thresholds', 'simulation_time', 'step_duration',
+                     'work_end_sat', 'work_start_mon', 'order_type', 'order_list', 'order_probability_step', 'items_per_type')
+# parameters of a Plant, its lines are Systems
+PLANT_PARAMETERS = ('maintenance_capacity', 'maintenance_priority', 'simulation_time')
+
+# source files of the simulation and the environments, a change of the code invalidates all results
+CODE = ['sim/*.py', 'SimEnv*.py', 'RewardFunction.py']
+
+_code_hashes = {}
+
+
+def hash_json(value):
+    """ sha256 of the canonical json of a value, sets are sorted and unknown objects replaced by their repr """
+    def default(obj):
+        if isinstance(obj, (set, frozenset)):
+            return sorted(obj)
+        if hasattr(obj, 'tolist'):
+            return obj.tolist()
+        return repr(obj)
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=default).encode()).hexdigest()
+
+
+def hash_arrays(*arrays):
+    """ sha256 of the dtype, shape and content of numpy arrays, e.g. of a lookup table """
+    digest = hashlib.sha256()
+    for array in arrays:
+        digest.update('{}{}'.format(array.dtype, array.shape).encode())
+        digest.update(array.tobytes())
+    return digest.hexdigest()
+
+
+def hash_state_dict(model):
+    """ sha256 of the weights of a torch model """
+    return hash_arrays(*(tensor.detach().cpu().numpy() for tensor in model.state_dict().values()))
+
+
+def hash_code(*files):
+    """ sha256 of the source files of the simulation and of the given files (computed once per process) """
+    filenames = sorted({filename for pattern in CODE for filename in glob.glob(os.path.join(SRC, pattern))} | set(files))
+    key = tuple(filenames)
+    if key not in _code_hashes:
+        digest = hashlib.sha256()
+        for filename in filenames:
+            digest.update(os.path.relpath(filename, SRC).encode())
+            with open(filename, 'rb') as f:
+                digest.update(f.read())
+        _code_hashes[key] = digest.hexdigest()
+    return _code_hashes[key]
+
+
+def describe_production_system(production_system):
+    """ all public attributes of a ProductionSystem (class and instance attributes), without methods and its logger """
+    return {name: getattr(production_system, name) for name in dir(production_system)
+            if not name.startswith('_') and not callable(getattr(production_system, name))
+            and not isinstance(getattr(production_system, name), logging.Logger)}
+
+
+def describe_system(system):
+    """ parameters and production systems of a System or a Plant """
+    if hasattr(system, 'lines'):
+        description = {name: getattr(system, name) for name in PLANT_PARAMETERS}
+        description['lines'] = [describe_system(line) for line in system.lines]
+        return description
+    description = {name: getattr(system, name) for name in SYSTEM_PARAMETERS}
+    description['production_system'] = describe_production_system(system.production_system)
+    description['production_system_class'] = type(system.production_system).__name__
+    return description
+
+
+def describe_policy(policy):
+    """ identity of a policy: its cache_key() if it has one, the hash of its weights for torch models, otherwise its class """
+    if hasattr(policy, 'cache_key'):
+        return policy.cache_key()
+    if hasattr(policy, 'state_dict'):
+        return '{}:{}'.format(type(policy).__name__, hash_state_dict(policy))
+    return type(policy).__name__
+
+
+class EvaluationCache():
+    """
+    Persistent cache of episode results (e.g. reward and produced parts), content-addressed by the hash of
+    the System parameters and ProductionSystem attributes, the environment, the policy, the seed of the episode
+    and the source code of the simulation. One json file per result in path/<key[:2]>/<key>.json.
+    """
+    def __init__(self, path):
+        self.logger = logging.getLogger("factory_sim")
+        self.path = path
+        os.makedirs(self.path, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, env, policy, seed, **settings):
+        """
+        Returns the key of an episode of policy in env with the given seed, further settings that change the result
+        (e.g. the number of steps of an evaluation) are passed as keyword arguments
+        """
+        description = {
+            'system': describe_system(env.system),
+            'env': type(env).__name__,
+            'multi_crew': getattr(env, 'multi_crew', False),
+            'policy': describe_policy(policy),
+            'seed': seed,
+            'settings': settings,
+            'code': hash_code(inspect.getsourcefile(type(policy))),
+        }
+        return hash_json(description)
+
+    def _filename(self, key):
+        return os.path.join(self.path, key[:2], key + '.json')
+
+    def get(self, key):
+        """ returns the cached result, None if there is none """
+        filename = self._filename(key)
+        if not os.path.exists(filename):
+            self.misses += 1
+            return None
+        with open(filename) as f:
+            self.hits += 1
+            return json.load(f)
+
+    def put(self, key, result):
+        """ stores a json serializable result """
+        filename = self._filename(key)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        # write to a temporary file first, concurrent evaluations may store the same result
+        with open(filename + '.{}.tmp'.format(os.getpid()), 'w') as f:
+            json.dump(result, f)
+        os.replace(filename + '.{}.tmp'.format(os.getpid()), filename)
@@ -1,14 +1,23 @@
+import random
 from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING
 import numpy as np
 
-from SimEnv import SimEnv
+from agent.EvaluationCache import hash_arrays
+
+# only for type hints, heuristics run without importing gym
+if TYPE_CHECKING:
+    from SimEnv import SimEnv
 
 
 class Heuristik(ABC):
     """
     Defines the structure of a heuristik-agent
     """
-    def __init__(self, env: SimEnv):
+    # the policy decides on the observation, otherwise on the state of the system
+    observe = False
+
+    def __init__(self, env: "SimEnv"):
         self.env = env
 
     @classmethod
@@ -19,8 +28,14 @@ class Heuristik(ABC):
         """
         pass
 
-    def schedule(self, epochs):
-        
+    def schedule(self, epochs, seed=None, cache=None):
+        """
+        Runs epochs episodes with the heuristic called directly inside the simulation (SimEnvIH.run_episode),
+        observations are only built if the heuristic decides on them.
+        With a seed, episode n is simulated with the seed seed+n. With an EvaluationCache (needs a seed),
+        the results of episodes that were simulated before are taken from the cache.
+        """
+        assert cache is None or seed is not None, 'Tried to cache an evaluation without a seed.'
         ep_rewards = [0.0]
 
         # tracking of simulation
@@ -28,22 +43,39 @@ class Heuristik(ABC):
         ep_rewards_mean = []
 
         for epoch in range(epochs):
-            next_sate = self.env.reset()
-            while True:
-                action = self._get_action()
-                next_sate, reward, done, _ = self.env.step(action)
+            result, key = None, None
+            if cache is not None:
+                key = cache.key(self.env, self, seed + epoch)
+                result = cache.get(key)
+            if result is None:
+                if seed is not None:
+                    self._seed(seed + epoch)
+                result = {'reward': self.env.run_episode(self._decide, observe=self.observe), 'parts_produced': self.env.get_parts_produced()}
+                if cache is not None:
+                    cache.put(key, result)
+
+            ep_rewards[-1] += result['reward']
+            ep_rewards.append(0.0)
+            produced_parts.append(result['parts_produced'])
+            ep_rewards_mean.append(self._get_mean_reward(ep_rewards))
+
+            print('epoch:', epoch)
+        
+        return ep_rewards, produced_parts, ep_rewards_mean
 
-                ep_rewards[-1] += reward
+    def _seed(self, seed):
+        """ seeds the random number generators of the simulation and of the action space """
+        random.seed(seed)
+        np.random.seed(seed)
+        self.env.action_space.seed(seed)
 
-                if done:
-                    ep_rewards.append(0.0)
-                    produced_parts.append(len(self.env.system.sink_store.items))
-                    ep_rewards_mean.append(self._get_mean_reward(ep_rewards))
+    def cache_key(self):
+        """ identity of the policy for the EvaluationCache, heuristics without parameters are identified by their class """
+        return type(self).__name__
 
-                    print('epoch:', epoch)
-                    break
-        
-        return ep_rewards, produced_parts, ep_rewards_mean
+    def _decide(self, observation):
+        """ policy callback of SimEnvIH.run_episode """
+        return self._get_action()
 
     def _get_mean_reward(self, ep_rewards):
         """ mean reward over 100 episodes"""
@@ -58,12 +90,16 @@ class RandomAgent(Heuristik):
     Selects actions according to a Random logic
     """
     
-    def __init__(self, env:SimEnv):
+    def __init__(self, env:"SimEnv"):
         super().__init__(env)
 
     def _get_action(self):
-        action = self.env.action_space.sample()
-        return action
+        # random choice among the valid actions
+        mask = self.env.get_action_mask()
+        if getattr(self.env, 'multi_crew', False):
+            return self.env.action_space.sample() * mask
+        action = self.env.action_space.np_random.choice(np.flatnonzero(mask))
+        return int(action)
 
 
 class FIFOAgent(Heuristik):
@@ -71,28 +107,100 @@ class FIFOAgent(Heuristik):
     Selects actions according to a FIF0 logic
     """
     
-    def __init__(self, env:SimEnv):
+    def __init__(self, env:"SimEnv"):
         super().__init__(env)
         self.actions = list(range(self.env.action_space.n))
 
     def _get_action(self):
+        if getattr(self.env, 'multi_crew', False):
+            return self._get_multi_crew_action()
+
         # if there is a maintenance resource available and at least one machine requested maintenance
-        if self.env.system.available_maintenance > 0 and len(self.env.system.machines_to_repair) > 0:
-             # assign as many maintenance resources as possibly
-                for i in range(self.env.system.available_maintenance):
-                    # check for machines still being available
-                    if len(self.env.system.machines_to_repair) > 0:
-                        # FIFO -> take first machine that requested repair
-                        machine = self.env.system.machines_to_repair[0]
-
-                        # remove the machine from the list of machines that requested maintenance
-                        self.env.system.machines_to_repair.remove(machine)
-                        self.env.logger.debug('Repairing machine {} with health {} due to FIFO maintenance logic. Machines waiting for repair: {}'.format(machine.id, machine.health,
-                             self.env.system.machines_to_repair), extra = {'simtime': self.env.system.sim_env.now})
-                    
-                    # choose action
-                    return self.env.system.machines.index(machine)
+        if self.env.system.available_maintenance > 0 and len(self.env.system.dispatcher) > 0:
+            # FIFO -> take first machine that requested repair (in the order of the dispatcher's priority)
+            machine = self.env.system.dispatcher.pop()
+            self.env.logger.debug('Repairing machine {} with health {} due to FIFO maintenance logic. Machines waiting for repair: {}'.format(machine.id, machine.health,
+                 len(self.env.system.dispatcher)), extra = {'simtime': self.env.system.sim_env.now})
+
+            # choose action
+            return self.env.system.machines.index(machine)
 
         else:
             # choose idle action
-            return self.actions[-1]
\ No newline at end of file
+            return self.actions[-1]
+
+    def _get_multi_crew_action(self):
+        """ assigns all available maintenance resources at once, in the order of the requests """
+        action = np.zeros(self.env.action_space.n, dtype=self.env.action_space.dtype)
+        for i in range(min(self.env.system.available_maintenance, len(self.env.system.dispatcher))):
+            # FIFO -> take first machine that requested repair
+            machine = self.env.system.dispatcher.pop()
+            self.env.logger.debug('Repairing machine {} with health {} due to FIFO maintenance logic. Machines waiting for repair: {}'.format(machine.id, machine.health,
+                 len(self.env.system.dispatcher)), extra = {'simtime': self.env.system.sim_env.now})
+            action[self.env.system.machines.index(machine)] = 1
+        return action
+
+
+class LookupTableAgent(Heuristik):
+    """
+    Selects actions from a lookup table indexed by the health states of the machines, e.g. the policy of ValueIteration
+    """
+
+    def __init__(self, env:"SimEnv", policy):
+        super().__init__(env)
+        self.policy = policy
+
+    def cache_key(self):
+        return '{}:{}'.format(type(self).__name__, hash_arrays(np.asarray(self.policy)))
+
+    def _get_action(self):
+        action = int(self.policy[tuple(machine.health for machine in self.env.system.machines)])
+        if getattr(self.env, 'multi_crew', False):
+            multi_crew_action = np.zeros(self.env.action_space.n, dtype=self.env.action_space.dtype)
+            if action < len(self.env.system.machines):
+                multi_crew_action[action] = 1
+            return multi_crew_action
+        return action
+
+
+class PolicyTableAgent(Heuristik):
+    """
+    Selects actions from a PolicyTable indexed by the observation, e.g. a DQNModel compiled with PolicyTable.from_dqn
+    """
+    observe = True
+
+    def __init__(self, env:"SimEnv", table):
+        super().__init__(env)
+        self.table = table
+
+    def cache_key(self):
+        return '{}:{}'.format(type(self).__name__, hash_arrays(self.table.table, self.table.radices))
+
+    def _get_action(self):
+        return self._decide(self.env._get_observation())
+
+    def _decide(self, observation):
+        return self.table.get_action(observation)
+
+
+class ThresholdAgent(FIFOAgent):
+    """
+    Threshold policy: machine n requests maintenance from health thresholds[n] on (system.cbm_thresholds),
+    the requests are repaired in the order of the dispatcher (FIFO), e.g. the result of ThresholdOptimizer.
+    The thresholds only apply to the episodes of schedule(), the System may be shared with other agents.
+    """
+
+    def __init__(self, env:"SimEnv", thresholds):
+        super().__init__(env)
+        self.thresholds = {machine.id: int(threshold) for machine, threshold in zip(self.env.system.machines, thresholds)}
+
+    def schedule(self, epochs, seed=None, cache=None):
+        # the machines of these episodes are created with the thresholds, afterwards the System has its own again
+        previous, self.env.system.cbm_thresholds = self.env.system.cbm_thresholds, self.thresholds
+        try:
+            return super().schedule(epochs, seed=seed, cache=cache)
+        finally:
+            self.env.system.cbm_thresholds = previous
+
+    def cache_key(self):
+        return '{}:{}'.format(type(self).__name__, sorted(self.thresholds.items()))
@@ -0,0 +1,193 @@
+import asyncio
+import logging
+import socket
+import struct
+
+import numpy as np
+import torch
+
+
+# protocol: a request is the number of observation values and of action mask values (uint32 each, 0 mask values:
+# all actions valid) followed by the observation as float32 and the mask as uint8,
+# the response is the number of action values (uint32) followed by the action as int64
+REQUEST_HEADER = struct.Struct('!II')
+HEADER = struct.Struct('!I')
+
+
+class InferenceServer():
+    """
+    Serves the actions of one trained DQNModel (or FactoredDQNModel) to many production lines. Requests are
+    collected for at most max_latency seconds after the first one (or until max_batch_size requests are waiting)
+    and answered with one forward pass for the whole batch. Actions are chosen among the valid ones if the request has
+    an action mask (info['action_mask'] of SimEnvIH), like DDQNAgent. Requests of the wrong size are rejected, a batch
+    whose forward pass fails only fails its own requests.
+    Use get_action() from coroutines of the same event loop, or serve() to accept clients over TCP (InferenceClient).
+    """
+    def __init__(self, model, max_batch_size=256, max_latency=0.002):
+        self.logger = logging.getLogger("factory_sim")
+        self.model = model
+        self.model.eval()
+        self.env_dims = self.model.fc1.in_features
+        # FactoredDQNModel: one mask value per machine, otherwise one per action
+        self.factored = hasattr(self.model, 'n_branches')
+        self.mask_dims = self.model.n_branches if self.factored else self.model.out.out_features
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.queue = None
+        self.worker = None
+
+        # statistics
+        self.requests = 0
+        self.batches = 0
+
+    async def start(self):
+        """ starts the batching worker in the running event loop """
+        self.queue = asyncio.Queue()
+        self.worker = asyncio.get_running_loop().create_task(self._batch_worker())
+
+    async def stop(self):
+        """ stops the batching worker, pending requests are cancelled """
+        self.worker.cancel()
+        try:
+            await self.worker
+        except asyncio.CancelledError:
+            pass
+        while not self.queue.empty():
+            _, _, future = self.queue.get_nowait()
+            future.cancel()
+
+    def check_request(self, size, mask_size=None):
+        """ returns why a request with an observation and mask of the given sizes does not fit the model, None if it does """
+        if size != self.env_dims:
+            return 'observation of size {}, the model expects {}'.format(size, self.env_dims)
+        if mask_size is not None and mask_size != self.mask_dims:
+            return 'action mask of size {}, the model expects {}'.format(mask_size, self.mask_dims)
+        return None
+
+    async def get_action(self, observation, mask=None):
+        """
+        returns the action of the model for one observation, batched with concurrent requests
+        :param mask: optional bool array of the valid actions (Discrete) or of the machines where maintenance is valid (MultiBinary)
+        """
+        error = self.check_request(np.size(observation), None if mask is None else np.size(mask))
+        if error is not None:
+            raise ValueError('Tried to request an action for an {}.'.format(error))
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((observation, mask, future))
+        return await future
+
+    async def _batch_worker(self):
+        """ collects requests into batches and answers them with one forward pass """
+        loop = asyncio.get_running_loop()
+        while True:
+            # wait for the first request, then for more until the latency window closes or the batch is full
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_latency
+            while len(batch) < self.max_batch_size:
+                # take what is already waiting without a timer
+                while not self.queue.empty() and len(batch) < self.max_batch_size:
+                    batch.append(self.queue.get_nowait())
+                timeout = deadline - loop.time()
+                if len(batch) >= self.max_batch_size or timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            observations, masks, futures = zip(*batch)
+            # requests without a mask allow all actions
+            valid = np.ones((len(batch), self.mask_dims), dtype=bool)
+            for row, mask in enumerate(masks):
+                if mask is not None:
+                    valid[row] = mask
+            try:
+                actions = self._predict(np.asarray(observations, dtype=np.float32), valid)
+            except Exception as exception:
+                # only the requests of this batch fail, the worker keeps serving the others
+                self.logger.warning('Inference of a batch of {} requests failed: {!r}'.format(len(batch), exception), extra = {'simtime': 0})
+                for future in futures:
+                    if not future.cancelled():
+                        future.set_exception(exception)
+                continue
+            for action, future in zip(actions, futures):
+                if not future.cancelled():
+                    future.set_result(action)
+            self.requests += len(batch)
+            self.batches += 1
+
+    def _predict(self, observations, masks):
+        """
+        greedy actions for a batch of observations among the valid ones (masks): int for Discrete,
+        binary array for MultiBinary (FactoredDQNModel), where maintenance is only chosen for machines where it is valid
+        """
+        with torch.no_grad():
+            q_values = self.model(torch.from_numpy(observations))
+            masks = torch.from_numpy(masks)
+            if self.factored:
+                q_values[..., 1] = q_values[..., 1].masked_fill(~masks, -float('inf'))
+                return list(q_values.argmax(dim=2).numpy().astype(np.int8))
+            q_values = q_values.masked_fill(~masks, -float('inf'))
+        return q_values.argmax(dim=1).tolist()
+
+    async def serve(self, host='127.0.0.1', port=5555):
+        """ accepts clients over TCP until cancelled """
+        if self.worker is None:
+            await self.start()
+        server = await asyncio.start_server(self._handle_client, host, port)
+        self.logger.info('Inference server listening on {}:{}'.format(host, port), extra = {'simtime': 0})
+        async with server:
+            await server.serve_forever()
+
+    async def _handle_client(self, reader, writer):
+        """ answers the requests of one client until it disconnects """
+        # the answers are small, send them immediately
+        writer.get_extra_info('socket').setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            while True:
+                size, mask_size = REQUEST_HEADER.unpack(await reader.readexactly(REQUEST_HEADER.size))
+                # reject a wrong request before reading it, its client gets no answer and the connection is closed
+                error = self.check_request(size, mask_size or None)
+                if error is not None:
+                    self.logger.warning('Rejected a client request with an {}'.format(error), extra = {'simtime': 0})
+                    break
+                observation = np.frombuffer(await reader.readexactly(4 * size), dtype=np.float32)
+                mask = np.frombuffer(await reader.readexactly(mask_size), dtype=np.uint8).astype(bool) if mask_size else None
+                action = np.atleast_1d(np.asarray(await self.get_action(observation, mask), dtype=np.int64))
+                writer.write(HEADER.pack(len(action)) + action.tobytes())
+        except asyncio.IncompleteReadError:
+            pass
+        finally:
+            writer.close()
+
+
+class InferenceClient():
+    """
+    Blocking client of an InferenceServer, e.g. for a process that simulates one production line
+    """
+    def __init__(self, host='127.0.0.1', port=5555):
+        self.socket = socket.create_connection((host, port))
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def get_action(self, observation, mask=None):
+        """
+        returns the action of the served model for one observation: int for Discrete, binary array for MultiBinary,
+        among the valid actions of the optional action mask
+        """
+        observation = np.asarray(observation, dtype=np.float32)
+        mask = np.empty(0, dtype=np.uint8) if mask is None else np.asarray(mask, dtype=np.uint8)
+        self.socket.sendall(REQUEST_HEADER.pack(observation.size, mask.size) + observation.tobytes() + mask.tobytes())
+        size, = HEADER.unpack(self._receive(HEADER.size))
+        action = np.frombuffer(self._receive(8 * size), dtype=np.int64)
+        return int(action[0]) if size == 1 else action.astype(np.int8)
+
+    def _receive(self, n_bytes):
+        data = b''
+        while len(data) < n_bytes:
+            chunk = self.socket.recv(n_bytes - len(data))
+            assert chunk, 'Tried to receive an action, but the inference server closed the connection.'
+            data += chunk
+        return data
+
+    def close(self):
+        self.socket.close()
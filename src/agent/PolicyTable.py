@@ -0,0 +1,88 @@
+import numpy as np
+
+
+class PolicyTable():
+    """
+    Dense lookup table of the actions of a policy over all observations of a SimEnvIH, integer-indexed by the
+    mixed-radix encoding of the observation: digit i of observation entry i has radix observation_space.high[i]+1.
+    Looking up an action is one array access and needs only numpy (no torch or gym), observation entries beyond
+    the table are clipped.
+    Tables of the same environment can be diffed, e.g. between two versions of a model.
+    """
+    def __init__(self, table, radices):
+        self.table = np.asarray(table)
+        self.radices = np.asarray(radices, dtype=np.int64)
+        assert self.table.size == np.prod(self.radices), 'Tried to create a table of size {} for radices {}.'.format(self.table.size, self.radices)
+
+        # the last observation entry is the least significant digit
+        self.strides = np.ones(len(self.radices), dtype=np.int64)
+        self.strides[:-1] = np.cumprod(self.radices[::-1])[::-1][1:]
+
+    @staticmethod
+    def get_radices(observation_space):
+        """ radices of the flattened observation space, its bounds must be non-negative integers """
+        # gym is only needed to compile the table, not to use it
+        from gym.spaces import utils
+        space = utils.flatten_space(observation_space)
+        assert (space.low == 0).all(), 'Tried to enumerate an observation space with lower bounds {}.'.format(space.low)
+        return space.high.astype(np.int64) + 1
+
+    def encode(self, observations):
+        """ indices of a batch of observations (or of one observation) in the table """
+        observations = np.clip(np.asarray(observations, dtype=np.int64), 0, self.radices - 1)
+        return observations @ self.strides
+
+    def decode(self, indices):
+        """ observations of a batch of indices, shape (len(indices), len(radices)) """
+        return np.asarray(indices, dtype=np.int64)[:, None] // self.strides % self.radices
+
+    def get_action(self, observation):
+        """ action for one observation """
+        return int(self.table[self.encode(observation)])
+
+    def diff(self, other):
+        """ indices of the observations where the actions of both tables differ """
+        assert (self.radices == other.radices).all(), 'Tried to diff tables of different observation spaces.'
+        return np.flatnonzero(self.table != other.table)
+
+    def save(self, path):
+        """ saves table and radices as .npz """
+        np.savez_compressed(path, table=self.table, radices=self.radices)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['table'], data['radices'])
+
+    @classmethod
+    def from_dqn(cls, model, env, batch_size=1<<18):
+        """
+        Compiles a DQNModel trained on env by evaluating it on all observations in batches.
+        Like DDQNAgent with the action mask, maintenance of a machine below its CBM_threshold (that cannot have requested
+        maintenance) is never chosen; masking of machines already under repair or without a free crew is left to the env.
+        """
+        import torch
+        from gym.spaces import utils
+        assert not getattr(env, 'multi_crew', False), 'Tried to compile a policy for multi_crew, only Discrete actions are supported.'
+        radices = cls.get_radices(env.observation_space)
+        n_actions = env.action_space.n
+        table = cls(np.empty(np.prod(radices), dtype=np.min_scalar_type(n_actions - 1)), radices)
+
+        # columns of the machine health in the flattened observation and the health from which each machine requests maintenance
+        health_columns = None
+        if 'machine_states' in getattr(env.observation_space, 'spaces', {}):
+            machines = env.system.machines
+            marker = {key: np.zeros(space.shape, dtype=space.dtype) for key, space in env.observation_space.spaces.items()}
+            marker['machine_states'] = np.arange(1, len(machines) + 1)
+            positions = utils.flatten(env.observation_space, marker)
+            health_columns = [int(np.flatnonzero(positions == n + 1)[0]) for n in range(len(machines))]
+            thresholds = torch.tensor([machine.CBM_threshold for machine in machines])
+
+        with torch.no_grad():
+            for start in range(0, table.table.size, batch_size):
+                observations = torch.from_numpy(table.decode(np.arange(start, min(start + batch_size, table.table.size))))
+                q_values = model(observations.float())
+                if health_columns is not None:
+                    q_values[:, :-1] = q_values[:, :-1].masked_fill(observations[:, health_columns] < thresholds, -float('inf'))
+                table.table[start:start + len(observations)] = q_values.argmax(dim=1).numpy()
+        return table
@@ -0,0 +1,254 @@
+import math
+import random
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.optim as optim
+
+from agent.DDQN import DQNModel
+
+
+class PopulationDQNModel(nn.Module):
+    """
+    Population of independent DQNModels with the same architecture, the weights of all members are stacked
+    along the first dimension and evaluated with batched matrix multiplications
+    """
+    def __init__(self, population, n_actions, env_dims, n_hidden1=14, n_hidden2=28):
+        super().__init__()
+        self.population = population
+        self.sizes = [env_dims, n_hidden1, n_hidden2, n_actions]
+        self.weights = nn.ParameterList()
+        self.biases = nn.ParameterList()
+        for in_features, out_features in zip(self.sizes[:-1], self.sizes[1:]):
+            # same initialization as nn.Linear
+            bound = 1 / math.sqrt(in_features)
+            self.weights.append(nn.Parameter(torch.empty(population, in_features, out_features).uniform_(-bound, bound)))
+            self.biases.append(nn.Parameter(torch.empty(population, 1, out_features).uniform_(-bound, bound)))
+
+    def forward(self, t):
+        """
+        Feedforward states of shape (population, batch, env_dims), returns Q-Values of shape (population, batch, n_actions)
+        """
+        for layer, (weight, bias) in enumerate(zip(self.weights, self.biases)):
+            t = torch.baddbmm(bias, t, weight)
+            # reLu activation functions for the hidden layers
+            if layer < len(self.weights) - 1:
+                t = torch.relu(t)
+        return t
+
+    def copy_members(self, model, members):
+        """
+        Copies the weights of the given members (bool tensor of shape (population,)) from another PopulationDQNModel
+        """
+        with torch.no_grad():
+            for own, other in zip(self.parameters(), model.parameters()):
+                own[members] = other[members]
+
+    def get_member(self, member):
+        """
+        Returns a DQNModel with the weights of one member, e.g. to evaluate it with the usual agents
+        """
+        model = DQNModel(n_actions=self.sizes[3], env_dims=self.sizes[0], n_hidden1=self.sizes[1], n_hidden2=self.sizes[2])
+        with torch.no_grad():
+            for linear, weight, bias in zip([model.fc1, model.fc2, model.out], self.weights, self.biases):
+                linear.weight.copy_(weight[member].t())
+                linear.bias.copy_(bias[member, 0])
+        return model
+
+
+class PopulationReplayMemory():
+    """
+    One Experience Replay per member, stored as stacked tensors. Sampling draws indices with replacement
+    (the single ReplayMemory samples without), which makes no difference for full buffers.
+    """
+    def __init__(self, population, capacity, state_dims, n_actions):
+        self.population = population
+        self.capacity = capacity
+        self.states = torch.zeros(population, capacity, state_dims)
+        self.actions = torch.zeros(population, capacity, dtype=torch.int64)
+        self.next_states = torch.zeros(population, capacity, state_dims)
+        self.rewards = torch.zeros(population, capacity)
+        self.dones = torch.zeros(population, capacity, dtype=torch.int32)
+        self.next_masks = torch.ones(population, capacity, n_actions, dtype=torch.bool)
+        self.memory_counter = torch.zeros(population, dtype=torch.int64)
+
+    def store(self, members, states, actions, next_states, rewards, dones, next_masks):
+        """
+        Save one experience for each of the given members (index tensor), the fields are stacked in the same order
+        """
+        index = self.memory_counter[members] % self.capacity
+        self.states[members, index] = states
+        self.actions[members, index] = actions
+        self.next_states[members, index] = next_states
+        self.rewards[members, index] = rewards
+        self.dones[members, index] = dones
+        self.next_masks[members, index] = next_masks
+        self.memory_counter[members] += 1
+
+    def sample_batch(self, batch_size):
+        """
+        Sample experiences of each member, tensors of shape (population, batch_size, ...)
+        """
+        size = torch.clamp(self.memory_counter, max=self.capacity)
+        indices = (torch.rand(self.population, batch_size) * size.unsqueeze(-1)).long()
+        members = torch.arange(self.population).unsqueeze(-1)
+        return (self.states[members, indices], self.actions[members, indices], self.next_states[members, indices],
+                self.rewards[members, indices], self.dones[members, indices], self.next_masks[members, indices])
+
+    def sample_possible(self, batch_size):
+        """
+        Check if sampling from the memory of every member is possible
+        """
+        return bool((self.memory_counter >= batch_size).all())
+
+
+class PopulationDDQNAgent():
+    """
+    Population of independent Double-DQN Agents (e.g. different seeds or hyperparameters) trained together:
+    each member has its own environment, Experience Replay and exploration, all members are updated
+    in one optimizer step on the stacked weights of a PopulationDQNModel.
+    gamma, epsilon, epsilon_decay, min_epsilon and target_update_iter can be given per member as lists,
+    lr is shared by all members (one Adam optimizer). Only Discrete actions are supported.
+    """
+    def __init__(self, envs, model, target_model, lr, buffer_sz, epsilon, epsilon_decay,
+    min_epsilon, gamma, target_update_iter, start_learning):
+        self.envs = envs
+        self.population = len(envs)
+        assert model.population == self.population, 'Tried to train a population of {} models with {} environments.'.format(model.population, self.population)
+        self.model = model
+        self.target_model = target_model
+        self.lr = lr
+        self.buffer_sz = buffer_sz
+        self.epsilon = self._per_member(epsilon)
+        self.epsilon_decay = self._per_member(epsilon_decay)
+        self.min_epsilon = self._per_member(min_epsilon)
+        self.gamma = torch.tensor(self._per_member(gamma), dtype=torch.float32).unsqueeze(-1)
+        self.target_update_iter = self._per_member(target_update_iter)
+        self.start_learning = start_learning
+
+        self.optimizer = optim.Adam(params=model.parameters(), lr=self.lr)
+        self.memory = PopulationReplayMemory(self.population, self.buffer_sz, self.envs[0].system_state_converter.get_observation_dims(),
+                                             self.envs[0].action_space.n)
+
+        # copy weights from model to target_model
+        self.target_model.load_state_dict(self.model.state_dict())
+        target_model.eval()
+
+        self.current_step = np.zeros(self.population, dtype=np.int64)
+
+    def _per_member(self, value):
+        """ a hyperparameter as list with one value per member """
+        if isinstance(value, (list, tuple, np.ndarray)):
+            assert len(value) == self.population, 'Tried to set {} values for a population of {}.'.format(len(value), self.population)
+            return list(value)
+        return [value] * self.population
+
+    def train(self, epochs, batch_sz):
+        """
+        Trains every member for the given number of epochs, a member that finished waits for the others
+        :return: ep_rewards, produced_parts, ep_rewards_mean as lists with one list per member
+        """
+        ep_rewards = [[0.0] for _ in range(self.population)]
+        produced_parts = [[] for _ in range(self.population)]
+        ep_rewards_mean = [[] for _ in range(self.population)]
+        epoch = np.zeros(self.population, dtype=np.int64)
+
+        states = torch.FloatTensor(np.array([env.reset() for env in self.envs]))
+        masks = torch.from_numpy(np.array([env.get_action_mask() for env in self.envs]))
+        while (epoch < epochs).any():
+            active = torch.from_numpy(epoch < epochs)
+            members = torch.nonzero(active).squeeze(-1)
+
+            actions = self._select_actions(states, masks)
+            next_states = states.clone()
+            next_masks = masks.clone()
+            rewards = torch.zeros(self.population)
+            dones = torch.zeros(self.population, dtype=torch.int32)
+            for member in members.tolist():
+                next_state, reward, done, info = self.envs[member].step(actions[member])
+                next_states[member] = torch.FloatTensor(next_state)
+                next_masks[member] = torch.from_numpy(info['action_mask'])
+                rewards[member] = reward
+                dones[member] = done
+                ep_rewards[member][-1] += reward
+            self.memory.store(members, states[members], torch.tensor(actions)[members], next_states[members], rewards[members], dones[members], next_masks[members])
+
+            # training of all members in one step
+            if self.memory.sample_possible(batch_sz):
+                self._optimize_model(batch_sz, active)
+
+            states = next_states
+            masks = next_masks
+            # Logging, update of target_model and reset of the members that finished an episode
+            for member in torch.nonzero(active & (dones == 1)).squeeze(-1).tolist():
+                ep_rewards[member].append(0.0)
+                produced_parts[member].append(self.envs[member].get_parts_produced())
+                ep_rewards_mean[member].append(self._get_mean_reward(ep_rewards[member]))
+                print('member:', member, 'epoch:', epoch[member])
+                if epoch[member] % self.target_update_iter[member] == 0 and epoch[member] != 0:
+                    self.target_model.copy_members(self.model, torch.arange(self.population) == member)
+                epoch[member] += 1
+                if epoch[member] < epochs:
+                    states[member] = torch.FloatTensor(self.envs[member].reset())
+                    masks[member] = torch.from_numpy(self.envs[member].get_action_mask())
+
+        return [rewards[:-1] for rewards in ep_rewards], produced_parts, ep_rewards_mean
+
+    def _select_actions(self, states, masks):
+        """
+        Select the actions of all members depending on their exploration strategies (eps-greedy), among the valid actions
+        """
+        exploration_rates = [end + (start - end) * math.exp(-1. * step * decay)
+                             for start, end, decay, step in zip(self.epsilon, self.min_epsilon, self.epsilon_decay, self.current_step)]
+        self.current_step += 1
+        # one forward pass for all members
+        with torch.no_grad():
+            greedy = self.model(states.unsqueeze(1)).squeeze(1).masked_fill(~masks, -float('inf')).argmax(dim=1).tolist()
+        return [int(env.action_space.np_random.choice(np.flatnonzero(mask))) if rate > random.random() else action
+                for env, rate, action, mask in zip(self.envs, exploration_rates, greedy, masks.numpy())]
+
+    def _optimize_model(self, batch_sz, active):
+        """
+        Performs one gradient step of all active members (bool tensor), each on a minibatch from its own Replay Memory
+        """
+        states, actions, next_states, rewards, dones, next_masks = self.memory.sample_batch(batch_sz)
+
+        # DDQN, as in DDQNAgent._get_loss per member
+        current_q_values = self.model(states).gather(dim=2, index=actions.unsqueeze(-1)).squeeze(-1)
+        index_ddqn = self.model(next_states).masked_fill(~next_masks, -float('inf')).argmax(2).detach().unsqueeze(-1)
+        next_q_values_from_target_of_model_indices = self.target_model(next_states).gather(dim=2, index=index_ddqn).squeeze(-1)
+        target_q_values = (next_q_values_from_target_of_model_indices*self.gamma)+rewards*(1-dones)
+
+        # sum of the mse losses of the members, the gradients of a member only depend on its own loss
+        loss = ((current_q_values - target_q_values.detach())**2).mean(dim=1)
+        self.optimizer.zero_grad()
+        loss.sum().backward()
+        self._clip_grad_norm(clip=1)
+
+        # finished members keep their weights (Adam would still move them with its momentum)
+        finished = ~active
+        if finished.any():
+            saved = [param.detach()[finished].clone() for param in self.model.parameters()]
+        self.optimizer.step()
+        if finished.any():
+            with torch.no_grad():
+                for param, weights in zip(self.model.parameters(), saved):
+                    param[finished] = weights
+
+    def _clip_grad_norm(self, clip):
+        """
+        Clips the gradient norm of each member separately, like nn.utils.clip_grad_norm_ for a single model
+        """
+        params = list(self.model.parameters())
+        norms = torch.sqrt(sum(param.grad.pow(2).flatten(1).sum(dim=1) for param in params))
+        scale = torch.clamp(clip / (norms + 1e-6), max=1.0)
+        for param in params:
+            param.grad.mul_(scale.view(-1, *([1] * (param.grad.dim() - 1))))
+
+    def _get_mean_reward(self, ep_rewards):
+        """ mean reward over 100 episodes"""
+        if len(ep_rewards) <= 100:
+            return np.mean(ep_rewards[-len(ep_rewards):-1])
+        else:
+            return np.mean(ep_rewards[-100:-1])
@@ -0,0 +1,99 @@
+import os
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from agent.Heuristics import ThresholdAgent
+from agent.EvaluationCache import EvaluationCache
+
+
+def _evaluate_worker(make_env, thresholds, seed, episodes, cache_path):
+    """ mean reward of a threshold policy over the episodes seed, ..., seed+episodes-1 """
+    env = make_env()
+    cache = EvaluationCache(cache_path) if cache_path is not None else None
+    ep_rewards, _, _ = ThresholdAgent(env, thresholds).schedule(episodes, seed=seed, cache=cache)
+    return float(np.mean(ep_rewards[:-1]))
+
+
+class ThresholdOptimizer():
+    """
+    Cross-entropy method over the CBM thresholds of all machines: each threshold has a categorical distribution over
+    min_threshold, ..., failed state (= never CBM, only CM). Per iteration, n_candidates threshold vectors are sampled and
+    simulated as ThresholdAgent on the same episodes_per_candidate seeds (common random numbers), the distributions move
+    towards the best elite_fraction of them. Candidates are simulated in parallel worker processes.
+    """
+    def __init__(self, make_env, n_candidates=32, episodes_per_candidate=4, elite_fraction=0.25, smoothing=0.7,
+                 min_threshold=1, workers=None, cache_path=None, seed=0):
+        """
+        :param make_env: picklable callable without arguments that returns a SimEnvIH, e.g. a module level function
+        :param cache_path: directory of an EvaluationCache, to not simulate the same candidate and seed again
+        """
+        self.logger = logging.getLogger("factory_sim")
+        self.make_env = make_env
+        self.n_candidates = n_candidates
+        self.episodes_per_candidate = episodes_per_candidate
+        self.n_elite = max(1, int(round(elite_fraction * n_candidates)))
+        self.smoothing = smoothing
+        self.workers = workers or os.cpu_count()
+        self.cache_path = cache_path
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)
+
+        env = make_env()
+        self.n_machines = len(env.system.machines)
+        self.thresholds = np.arange(min_threshold, env.system.machines[0].failed_state + 1)
+        self.probabilities = np.full((self.n_machines, len(self.thresholds)), 1 / len(self.thresholds))
+
+        self.best_thresholds = None
+        self.best_reward = -float('inf')
+
+    def sample(self):
+        """ samples n_candidates threshold vectors, shape (n_candidates, n_machines) """
+        indices = np.stack([self.rng.choice(len(self.thresholds), size=self.n_candidates, p=probabilities)
+                            for probabilities in self.probabilities], axis=1)
+        return self.thresholds[indices]
+
+    def evaluate(self, candidates, seed, episodes, executor=None):
+        """ mean rewards of the candidates, all on the episodes seed, ..., seed+episodes-1, in the executor's processes if given """
+        if executor is None:
+            return np.array([_evaluate_worker(self.make_env, candidate, seed, episodes, self.cache_path) for candidate in candidates])
+        futures = [executor.submit(_evaluate_worker, self.make_env, candidate, seed, episodes, self.cache_path) for candidate in candidates]
+        return np.array([future.result() for future in futures])
+
+    def optimize(self, iterations=10, final_episodes=20):
+        """
+        Runs the cross-entropy method, stops early when all distributions have converged. The most likely thresholds
+        and the best candidates of the last iteration are compared on final_episodes new seeds.
+        :return: ThresholdAgent with the best thresholds, in an environment of make_env
+        """
+        # one pool of worker processes for all iterations
+        executor = ProcessPoolExecutor(max_workers=self.workers) if self.workers > 1 else None
+        try:
+            return self._optimize(iterations, final_episodes, executor)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+    def _optimize(self, iterations, final_episodes, executor):
+        seed = self.seed
+        for iteration in range(iterations):
+            candidates = self.sample()
+            rewards = self.evaluate(candidates, seed, self.episodes_per_candidate, executor)
+            seed += self.episodes_per_candidate
+
+            elite = candidates[np.argsort(-rewards)[:self.n_elite]]
+            frequencies = (elite[:, :, None] == self.thresholds).mean(axis=0)
+            self.probabilities = (1 - self.smoothing) * self.probabilities + self.smoothing * frequencies
+            self.logger.info('Iteration {}: best {:.3f}, mean {:.3f}, most likely thresholds {}'.format(iteration, rewards.max(), rewards.mean(),
+                             self.thresholds[self.probabilities.argmax(axis=1)].tolist()), extra = {'simtime': 0})
+            if (self.probabilities.max(axis=1) > 0.95).all():
+                break
+
+        # the rewards of the elite are biased by the selection, they are compared on new seeds
+        finalists = np.unique(np.vstack([self.thresholds[self.probabilities.argmax(axis=1)], elite]), axis=0)
+        rewards = self.evaluate(finalists, seed, final_episodes, executor)
+        self.best_thresholds, self.best_reward = finalists[rewards.argmax()], rewards.max()
+        self.logger.info('Best thresholds {} with mean reward {:.3f} over {} episodes'.format(self.best_thresholds.tolist(), self.best_reward, final_episodes),
+                         extra = {'simtime': 0})
+        return ThresholdAgent(self.make_env(), self.best_thresholds)
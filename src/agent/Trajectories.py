@@ -0,0 +1,228 @@
+import os
+import re
+import glob
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from RewardFunction import StatusTrace
+
+
+# columns of a trajectory chunk, next_masks: valid actions in next_states (info['action_mask'])
+COLUMNS = ('states', 'actions', 'rewards', 'next_states', 'dones', 'next_masks')
+
+
+class TrajectoryRecorder():
+    """
+    Records the experiences of a policy (e.g. a Heuristik) in an environment into chunks of compressed columnar files
+    (one .npz file per chunk_size experiences with the arrays states, actions, rewards, next_states, dones, next_masks).
+    With record_traces, the StatusTrace of each episode is saved in path/traces to relabel the rewards later.
+    Recording into a path with chunks (or traces) of the same prefix continues their numbering, nothing is overwritten.
+    """
+    def __init__(self, env, agent, path, chunk_size=10000, prefix='chunk', record_traces=False):
+        self.env = env
+        self.agent = agent
+        self.path = path
+        self.chunk_size = chunk_size
+        self.prefix = prefix
+        os.makedirs(self.path, exist_ok=True)
+
+        self.record_traces = record_traces
+        if self.record_traces:
+            self.env.record_trace = True
+            os.makedirs(os.path.join(self.path, 'traces'), exist_ok=True)
+        self.episode_counter = self._next_number(os.path.join(self.path, 'traces'))
+
+        self.chunk = {column: [] for column in COLUMNS}
+        self.chunk_counter = self._next_number(self.path)
+
+    def _next_number(self, path):
+        """ the number after the last file prefix-<number>.npz in path, 0 if there is none """
+        pattern = re.compile(re.escape(self.prefix) + r'-(\d+)\.npz')
+        numbers = [int(match.group(1)) for match in map(pattern.fullmatch, os.listdir(path)) if match] if os.path.isdir(path) else []
+        return max(numbers, default=-1) + 1
+
+    def record(self, episodes):
+        """
+        Runs the policy for the given number of episodes and writes all experiences
+        :return: number of recorded experiences
+        """
+        experiences = 0
+        for episode in range(episodes):
+            state = self.env.reset()
+            while True:
+                action = self.agent._get_action()
+                next_state, reward, done, info = self.env.step(action)
+                self.store(state, action, reward, next_state, done, info['action_mask'])
+                experiences += 1
+                state = next_state
+                if done:
+                    break
+            if self.record_traces:
+                self.env.trace.save(os.path.join(self.path, 'traces', '{}-{:06d}.npz'.format(self.prefix, self.episode_counter)))
+            self.episode_counter += 1
+        self.flush()
+        return experiences
+
+    def store(self, state, action, reward, next_state, done, next_mask):
+        """
+        Adds one experience to the current chunk, writes the chunk if it is full
+        """
+        self.chunk['states'].append(state)
+        self.chunk['actions'].append(action)
+        self.chunk['rewards'].append(reward)
+        self.chunk['next_states'].append(next_state)
+        self.chunk['dones'].append(done)
+        self.chunk['next_masks'].append(next_mask)
+        if len(self.chunk['states']) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the current chunk
+        """
+        if len(self.chunk['states']) == 0:
+            return
+        filename = os.path.join(self.path, '{}-{:05d}.npz'.format(self.prefix, self.chunk_counter))
+        np.savez_compressed(filename,
+            states=np.array(self.chunk['states'], dtype=np.float32),
+            actions=np.array(self.chunk['actions'], dtype=np.int64),
+            rewards=np.array(self.chunk['rewards'], dtype=np.float32),
+            next_states=np.array(self.chunk['next_states'], dtype=np.float32),
+            dones=np.array(self.chunk['dones'], dtype=np.int32),
+            next_masks=np.array(self.chunk['next_masks'], dtype=bool))
+        self.chunk = {column: [] for column in COLUMNS}
+        self.chunk_counter += 1
+
+
+def _record_worker(make_env, make_agent, path, episodes, seed, prefix, chunk_size, record_traces):
+    """ records episodes in a worker process, every worker writes its own chunks """
+    random.seed(seed)
+    np.random.seed(seed)
+    env = make_env()
+    env.action_space.seed(seed)
+    recorder = TrajectoryRecorder(env, make_agent(env), path, chunk_size=chunk_size, prefix=prefix, record_traces=record_traces)
+    return recorder.record(episodes)
+
+
+def record_parallel(make_env, make_agent, path, episodes, workers=None, chunk_size=10000, seed=0, record_traces=False):
+    """
+    Records episodes in parallel worker processes
+    :param make_env: picklable callable without arguments that returns an environment, e.g. a module level function
+    :param make_agent: picklable callable that returns the policy for an environment, e.g. FIFOAgent
+    :return: number of recorded experiences
+    """
+    workers = workers or os.cpu_count()
+    # split the episodes as evenly as possible
+    shares = [episodes // workers + (1 if worker < episodes % workers else 0) for worker in range(workers)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_record_worker, make_env, make_agent, path, share, seed + worker, 'seed{}-worker{:03d}'.format(seed, worker), chunk_size, record_traces)
+                   for worker, share in enumerate(shares) if share > 0]
+        return sum(future.result() for future in futures)
+
+
+class TrajectoryDataset():
+    """
+    Recorded experiences of all chunks in path. The compressed chunks are unpacked once into one .npy file
+    per column (in path/cache), which are memory-mapped. Can be sampled like a ReplayMemory.
+    next_masks is None for chunks recorded without action masks.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.cache_path = os.path.join(self.path, 'cache')
+        self.chunks = sorted(glob.glob(os.path.join(self.path, '*.npz')))
+        assert len(self.chunks) > 0, 'Tried to load trajectories from {}, but there are no chunks.'.format(self.path)
+
+        if not self._cache_is_valid():
+            self._build_cache()
+        for column in COLUMNS:
+            filename = os.path.join(self.cache_path, column + '.npy')
+            setattr(self, column, np.load(filename, mmap_mode='r') if os.path.exists(filename) else None)
+
+    def __len__(self):
+        return len(self.rewards)
+
+    def _chunk_signatures(self):
+        """ name, size and modification time of each chunk, a rewritten chunk has another signature """
+        signatures = []
+        for chunk in self.chunks:
+            stat = os.stat(chunk)
+            signatures.append('{} {} {}'.format(os.path.basename(chunk), stat.st_size, stat.st_mtime_ns))
+        return signatures
+
+    def _cache_is_valid(self):
+        """ the cache is valid if it was built from the current chunks (same names, sizes and modification times) """
+        index = os.path.join(self.cache_path, 'chunks.txt')
+        if not os.path.exists(index):
+            return False
+        with open(index) as f:
+            return f.read().split('\n') == self._chunk_signatures()
+
+    def _chunk_column(self, column):
+        """ the column of each chunk, None for chunks without it """
+        arrays = []
+        for chunk in self.chunks:
+            with np.load(chunk) as data:
+                arrays.append(data[column] if column in data else None)
+        return arrays
+
+    def _build_cache(self):
+        """ unpacks the chunks column by column into .npy files """
+        os.makedirs(self.cache_path, exist_ok=True)
+        for column in COLUMNS:
+            arrays = self._chunk_column(column)
+            filename = os.path.join(self.cache_path, column + '.npy')
+            if any(array is None for array in arrays):
+                # chunks recorded without action masks allow all actions, without any masks there is no column
+                assert column == 'next_masks', 'Tried to load trajectories from {}, but a chunk has no {}.'.format(self.path, column)
+                shape = next((array.shape[1:] for array in arrays if array is not None), None)
+                if shape is None:
+                    if os.path.exists(filename):
+                        os.remove(filename)
+                    continue
+                arrays = [np.ones((len(rewards),) + shape, dtype=bool) if array is None else array
+                          for array, rewards in zip(arrays, self._chunk_column('rewards'))]
+            np.save(filename, np.concatenate(arrays))
+        # written last, an interrupted build is repeated
+        with open(os.path.join(self.cache_path, 'chunks.txt'), 'w') as f:
+            f.write('\n'.join(self._chunk_signatures()))
+
+    def relabel(self, reward_function, **costs):
+        """
+        Replaces the rewards by the rewards of another reward function or other costs (e.g. RewardR2 with c_cm=2),
+        computed from the StatusTraces recorded with the chunks (in the order of the chunks, i.e. by prefix and episode)
+        :return: np.array, the new rewards
+        """
+        traces = sorted(glob.glob(os.path.join(self.path, 'traces', '*.npz')))
+        assert len(traces) > 0, 'Tried to relabel trajectories from {}, but there are no traces.'.format(self.path)
+        rewards = []
+        for filename in traces:
+            trace = StatusTrace.load(filename)
+            rewards.append(trace.step_rewards(reward_function.relabel(trace, **costs)[0]))
+        rewards = np.concatenate(rewards).astype(np.float32)
+        assert len(rewards) == len(self), 'Tried to relabel {} experiences with traces of {} steps.'.format(len(self), len(rewards))
+        self.rewards = rewards
+        return rewards
+
+    def sample_batch(self, batch_size):
+        """
+        Sample experiences and return them as tensors (states, actions, next_states, rewards, dones, next_masks),
+        next_masks is None if the trajectories were recorded without action masks
+        """
+        # torch is only needed for training, not for recording
+        import torch
+        # sorted indices to read the files as sequentially as possible
+        indices = sorted(random.sample(range(len(self)), batch_size))
+        return (torch.from_numpy(self.states[indices]),
+                torch.from_numpy(self.actions[indices]),
+                torch.from_numpy(self.next_states[indices]),
+                torch.from_numpy(self.rewards[indices]),
+                torch.from_numpy(self.dones[indices]),
+                None if self.next_masks is None else torch.from_numpy(self.next_masks[indices]))
+
+    def sample_possible(self, batch_size):
+        """
+        Check if sampling from the dataset is possible
+        """
+        return len(self) >= batch_size
@@ -0,0 +1,106 @@
+import logging
+import numpy as np
+
+from RewardFunction import RewardR2
+
+
+class ValueIteration():
+    """
+    Solves the maintenance planning of a System exactly as semi-Markov decision process over the joint
+    health states of all machines, using the costs of RewardR2.
+
+    At each decision the agent either stays idle for one step or repairs one machine that requested maintenance,
+    which takes repair_durations['cbm'] steps (repair_durations['cm'] if the machine failed). Meanwhile, all other
+    machines that have not failed degrade according to their degradation matrix. Like in SimEnvIH,
+    decisions are only made if a machine requested maintenance, otherwise the system stays idle.
+
+    The joint transition matrix is the Kronecker product of the degradation matrices of the machines,
+    it is never built: expectations are computed axis by axis on the value array of shape (dim,)*n_machines.
+
+    Approximations: only one maintenance resource, the buffers are not part of the state, machines
+    degrade whenever they have not failed (use utilization to scale the degradation rates by the share
+    of steps a machine actually works), weekends are ignored.
+    """
+    def __init__(self, system, gamma=0.99, utilization=None):
+        self.logger = logging.getLogger("factory_sim")
+        assert system.maintenance_capacity == 1, 'Tried to solve a system with maintenance_capacity {}, only 1 is supported.'.format(system.maintenance_capacity)
+
+        self.machines = system.machines
+        self.n_machines = len(self.machines)
+        self.gamma = gamma
+        self.dim = len(self.machines[0].degradation)
+        self.failed_state = self.dim-1
+        self.CBM_thresholds = np.array([machine.CBM_threshold for machine in self.machines])
+        if utilization is None:
+            utilization = np.ones(self.n_machines)
+
+        # degradation matrix of each machine per step, a machine only degrades in the share of steps it is working
+        self.degradation = [(1 - u) * np.eye(self.dim) + u * machine.degradation for machine, u in zip(self.machines, utilization)]
+        # transitions during the repairs, by duration
+        durations = {duration for machine in self.machines for duration in machine.repair_durations.values()}
+        self.repair_degradation = {duration: [np.linalg.matrix_power(matrix, duration) for matrix in self.degradation] for duration in durations}
+
+        # costs per step as in RewardR2
+        self.idle_cost = 10 * RewardR2.c_cbm
+        self.repair_costs = {'cbm': [RewardR2.c_cbm/machine.repair_durations['cbm'] + RewardR2.c_pv/(machine.repair_durations['cbm']**2) for machine in self.machines],
+                             'cm': [RewardR2.c_cm/machine.repair_durations['cm'] + RewardR2.c_pv/(machine.repair_durations['cm']**2) for machine in self.machines]}
+
+        # health of each machine as array over the joint state space
+        health = np.indices((self.dim,)*self.n_machines)
+        self.any_failed = (health == self.failed_state).any(axis=0)
+        # decisions are only made if maintenance was requested, only machines that requested it can be maintained
+        self.requested = health >= self.CBM_thresholds.reshape((-1,) + (1,)*self.n_machines)
+
+        self.values = np.zeros((self.dim,)*self.n_machines)
+        self.policy = np.full((self.dim,)*self.n_machines, self.n_machines)
+
+    def _expect(self, values, matrices, skip=None):
+        """
+        Expected values after one transition of each machine with its matrix (machine skip keeps its state)
+        """
+        for axis, matrix in enumerate(matrices):
+            if axis != skip:
+                values = np.moveaxis(np.tensordot(matrix, values, axes=([1], [axis])), 0, axis)
+        return values
+
+    def _get_q_values(self, values):
+        """
+        Q-Values of all actions in all states, shape (n_machines+1, dim, ..., dim): maintenance machine n; n+1: idle
+        """
+        q_values = np.empty((self.n_machines+1,) + values.shape)
+
+        # idle: costs of the step depend on the state after the step
+        q_values[-1] = self._expect(-self.idle_cost * self.any_failed + self.gamma * values, self.degradation)
+
+        for n, machine in enumerate(self.machines):
+            for repair_type in ['cbm', 'cm']:
+                duration = machine.repair_durations[repair_type]
+                # costs during repair, the machine is repaired afterwards
+                costs = self.repair_costs[repair_type][n] * np.sum(self.gamma ** np.arange(duration))
+                repaired = np.take(values, [0], axis=n)
+                q_repair = -costs + self.gamma**duration * self._expect(repaired, self.repair_degradation[duration], skip=n)
+                # cm if the machine failed, cbm otherwise
+                index = [slice(None)] * self.n_machines
+                index[n] = slice(self.failed_state, None) if repair_type == 'cm' else slice(0, self.failed_state)
+                q_values[n][tuple(index)] = np.broadcast_to(q_repair, values.shape)[tuple(index)]
+
+        # without a decision, the system stays idle, machines that did not request maintenance are invalid actions (as in SimEnvIH)
+        q_values[:-1][~self.requested] = -np.inf
+        return q_values
+
+    def solve(self, tolerance=1e-3, max_iterations=10000):
+        """
+        Runs value iteration until the values change less than tolerance
+        :return: np.array, lookup table of the actions of SimEnvIH indexed by the health states of the machines
+        """
+        for iteration in range(max_iterations):
+            q_values = self._get_q_values(self.values)
+            values = q_values.max(axis=0)
+            delta = np.abs(values - self.values).max()
+            self.values = values
+            if delta < tolerance:
+                break
+        self.logger.info('Value iteration finished after {} iterations, delta {}'.format(iteration+1, delta), extra = {'simtime': 0})
+
+        self.policy = self._get_q_values(self.values).argmax(axis=0)
+        return self.policy
@@ -0,0 +1,80 @@
+"""
+Env pool benchmark: runs episodes of --envs SimEnvIH with the greedy policy of a DQNModel, once one env after the other
+with one forward pass per decision and once interleaved in an AsyncEnvPool with one batched forward pass per round.
+Run from src: python benchmarks/env_pool.py [--envs N] [--episodes N]
+"""
+import argparse
+import logging
+import os
+import random
+import sys
+import time
+
+import numpy as np
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from SimEnv_IH import SimEnvIH
+from sim.System import System
+from sim import ProductionExamples
+from agent.DDQN import DQNModel
+from agent.EnvPool import AsyncEnvPool, greedy_policy
+
+
+def make_envs(n, production_system, seed):
+    envs = [SimEnvIH(System(use_case = "ih", production_system = getattr(ProductionExamples, production_system)())) for _ in range(n)]
+    for i, env in enumerate(envs):
+        env.action_space.seed(seed + i)
+    return envs
+
+
+def run_sequential(envs, policy, episodes):
+    """ returns the number of decisions, one policy call per decision """
+    decisions = 0
+    for env in envs:
+        for _ in range(episodes):
+            state = env.reset()
+            mask = env.get_action_mask()
+            done = False
+            while not done:
+                action = policy(np.asarray([state], dtype=np.float32), mask[None])[0]
+                state, _, done, info = env.step(action)
+                mask = info['action_mask']
+                decisions += 1
+    return decisions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--envs', type=int, default=200)
+    parser.add_argument('--episodes', type=int, default=1, help='episodes per env')
+    parser.add_argument('--production-system', default='ProductionSystem1')
+    parser.add_argument('--hidden', type=int, nargs=2, default=[14, 28], help='n_hidden1, n_hidden2 of the DQNModel')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format='%(simtime)6d %(message)s')
+    torch.set_num_threads(1)
+    random.seed(0)
+    np.random.seed(0)
+    torch.manual_seed(0)
+
+    envs = make_envs(args.envs, args.production_system, 0)
+    model = DQNModel(n_actions=envs[0].action_space.n, env_dims=envs[0].system_state_converter.get_observation_dims(),
+                     n_hidden1=args.hidden[0], n_hidden2=args.hidden[1])
+    policy = greedy_policy(model)
+
+    start = time.perf_counter()
+    decisions = run_sequential(envs, policy, args.episodes)
+    duration = time.perf_counter() - start
+    print('sequential {:5d} envs  {:8.0f} decisions/s  {:6.2f} s'.format(args.envs, decisions / duration, duration))
+
+    pool = AsyncEnvPool(make_envs(args.envs, args.production_system, 0), policy)
+    start = time.perf_counter()
+    pool.run(args.episodes)
+    duration = time.perf_counter() - start
+    print('pool       {:5d} envs  {:8.0f} decisions/s  {:6.2f} s  mean batch {:6.1f}'.format(args.envs, pool.decisions / duration, duration,
+        pool.decisions / pool.batches))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+Import-time benchmark: imports each module in a fresh interpreter and checks the cumulative import time
+(python -X importtime) against its budget, and that no heavy dependency is pulled in.
+Run from src: python benchmarks/import_time.py [--repeat N]
+Exits with 1 if a budget is exceeded or a forbidden module was imported.
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+
+# budgets in ms, the simulation itself only needs simpy and numpy
+BUDGETS = {
+    'sim.System': 400,
+    'sim.ProductionExamples': 100,
+    'sim.ThroughputEstimator': 300,
+    'agent.Heuristics': 400,
+    'agent.ValueIteration': 400,
+}
+
+# modules the simulation and the heuristics must not import
+FORBIDDEN = ['torch', 'matplotlib', 'gym']
+
+SRC = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(module):
+    """ returns the cumulative import time in ms and the forbidden modules imported by a fresh interpreter """
+    code = 'import sys, {}; print(",".join(m for m in {} if m in sys.modules))'.format(module, FORBIDDEN)
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=SRC, capture_output=True, text=True, check=True)
+    # lines: "import time: self [us] | cumulative | imported package", the module itself is listed after its imports
+    cumulative = 0
+    for line in result.stderr.splitlines():
+        fields = line.split('|')
+        if len(fields) == 3 and fields[2].strip() == module:
+            cumulative = int(fields[1])
+    forbidden = [m for m in result.stdout.strip().split(',') if m]
+    return cumulative / 1000, forbidden
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=5, help='imports per module, the fastest one counts')
+    args = parser.parse_args()
+
+    failed = False
+    for module, budget in BUDGETS.items():
+        times, forbidden = [], []
+        for _ in range(args.repeat):
+            time, forbidden = measure(module)
+            times.append(time)
+        ok = min(times) <= budget and not forbidden
+        failed = failed or not ok
+        print('{:<28} {:8.1f} ms  budget {:5d} ms  {}{}'.format(module, min(times), budget, 'ok' if ok else 'FAILED',
+            '  imports {}'.format(', '.join(forbidden)) if forbidden else ''))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
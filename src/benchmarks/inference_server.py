@@ -0,0 +1,124 @@
+"""
+Inference server benchmark: many production lines request actions from one InferenceServer.
+in-process: --clients coroutines send random observations back to back (throughput and latency of the batching)
+tcp: --lines processes each simulate one SimEnvIH line and get their actions over TCP
+Run from src: python benchmarks/inference_server.py [--clients N] [--lines N] [--max-latency S]
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from SimEnv_IH import SimEnvIH
+from sim.System import System
+from sim.ProductionExamples import ProductionSystem1
+from agent.DDQN import DQNModel
+from agent.InferenceServer import InferenceServer, InferenceClient
+
+
+def make_env():
+    return SimEnvIH(System(use_case = "ih", production_system = ProductionSystem1()))
+
+
+async def run_in_process(model, env_dims, clients, requests_per_client, max_batch_size, max_latency):
+    """ returns decisions per second, latencies in s and the mean batch size """
+    server = InferenceServer(model, max_batch_size=max_batch_size, max_latency=max_latency)
+    await server.start()
+    latencies = []
+
+    async def client():
+        observations = np.random.random((requests_per_client, env_dims)).astype(np.float32)
+        for observation in observations:
+            start = time.perf_counter()
+            await server.get_action(observation)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(clients)))
+    duration = time.perf_counter() - start
+    await server.stop()
+    return len(latencies) / duration, np.array(latencies), server.requests / server.batches
+
+
+def run_line(port, episodes, seed, results):
+    """ stand-in process of one production line: simulates episodes with the actions of the server """
+    logging.disable(logging.INFO)
+    random.seed(seed)
+    np.random.seed(seed)
+    env = make_env()
+    client = InferenceClient(port=port)
+    decisions, waiting = 0, 0.0
+    for _ in range(episodes):
+        observation = env.reset()
+        mask = env.get_action_mask()
+        done = False
+        while not done:
+            start = time.perf_counter()
+            action = client.get_action(observation, mask)
+            waiting += time.perf_counter() - start
+            observation, _, done, info = env.step(action)
+            mask = info['action_mask']
+            decisions += 1
+    client.close()
+    results.put((decisions, waiting))
+
+
+def run_tcp(model, lines, episodes, max_batch_size, max_latency, port):
+    """ returns decisions per second and the mean time a line waits for an action """
+    server = InferenceServer(model, max_batch_size=max_batch_size, max_latency=max_latency)
+    results = multiprocessing.Queue()
+
+    async def main():
+        serving = asyncio.get_running_loop().create_task(server.serve(port=port))
+        await asyncio.sleep(0.5)
+        processes = [multiprocessing.Process(target=run_line, args=(port, episodes, seed, results)) for seed in range(lines)]
+        start = time.perf_counter()
+        for process in processes:
+            process.start()
+        loop = asyncio.get_running_loop()
+        outcomes = [await loop.run_in_executor(None, results.get) for _ in processes]
+        duration = time.perf_counter() - start
+        serving.cancel()
+        return outcomes, duration
+
+    outcomes, duration = asyncio.run(main())
+    decisions = sum(outcome[0] for outcome in outcomes)
+    return decisions / duration, sum(outcome[1] for outcome in outcomes) / decisions, server.requests / max(1, server.batches)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--clients', type=int, default=1000, help='concurrent clients in-process')
+    parser.add_argument('--requests', type=int, default=20, help='requests per in-process client')
+    parser.add_argument('--lines', type=int, default=os.cpu_count(), help='line processes over TCP, 0 to skip')
+    parser.add_argument('--episodes', type=int, default=2, help='episodes per line process')
+    parser.add_argument('--max-batch-size', type=int, default=256)
+    parser.add_argument('--max-latency', type=float, default=0.002, help='latency window in s')
+    parser.add_argument('--port', type=int, default=5555)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format='%(simtime)6d %(message)s')
+
+    env = make_env()
+    env_dims = env.system_state_converter.get_observation_dims()
+    model = DQNModel(n_actions=env.action_space.n, env_dims=env_dims)
+
+    rate, latencies, batch_size = asyncio.run(run_in_process(model, env_dims, args.clients, args.requests, args.max_batch_size, args.max_latency))
+    print('in-process {:5d} clients  {:8.0f} decisions/s  latency p50 {:6.2f} ms  p99 {:6.2f} ms  mean batch {:6.1f}'.format(
+        args.clients, rate, 1000*np.percentile(latencies, 50), 1000*np.percentile(latencies, 99), batch_size))
+
+    if args.lines > 0:
+        rate, waiting, batch_size = run_tcp(model, args.lines, args.episodes, args.max_batch_size, args.max_latency, args.port)
+        print('tcp        {:5d} lines    {:8.0f} decisions/s  mean wait {:6.2f} ms  mean batch {:6.1f}'.format(
+            args.lines, rate, 1000*waiting, batch_size))
+
+
+if __name__ == '__main__':
+    main()
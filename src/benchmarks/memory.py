@@ -0,0 +1,161 @@
+"""
+Memory benchmark: runs episodes of SimEnvIH under tracemalloc and reports the top allocation sites per subsystem
+(sim, env, converter, replay), the steady-state growth of the traced memory per episode and the number of live
+simpy generators, e.g. processes of a previous System.initialize that are still referenced.
+Actions are random valid actions, with --replay the experiences are stored in a ReplayMemory (needs torch),
+the data of the tensors is allocated by torch and not traced, only the tensor objects and the numpy arrays.
+Run from src: python benchmarks/memory.py [--episodes N] [--warmup N] [--threshold KB] [--replay]
+Exits with 1 if the growth per episode exceeds the threshold.
+"""
+import argparse
+import gc
+import inspect
+import logging
+import os
+import random
+import sys
+import tracemalloc
+import types
+from collections import defaultdict
+
+import numpy as np
+
+SRC = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SRC)
+
+from SimEnv_IH import SimEnvIH
+from sim.System import System
+from sim import ProductionExamples
+
+
+# subsystem of an allocation site, by its file relative to src (the first match counts)
+SUBSYSTEMS = [
+    ('converter', ('sim/SimulationStateConverter.py', 'sim/SSC_')),
+    ('replay', ('agent/DDQN.py', 'agent/PopulationDDQN.py', 'agent/Trajectories.py')),
+    ('sim', ('sim/',)),
+    ('env', ('SimEnv', 'RewardFunction.py')),
+]
+
+
+def get_site(traceback):
+    """ returns the subsystem and the most recent frame in src of a traceback, the allocation site """
+    for frame in reversed(traceback):
+        if frame.filename == __file__ and frame.lineno in REPLAY_LINES:
+            return 'replay', '{}:{}'.format(os.path.relpath(frame.filename, SRC), frame.lineno)
+        filename = os.path.relpath(frame.filename, SRC)
+        if filename.startswith(('..', '<', 'benchmarks')):
+            continue
+        for subsystem, prefixes in SUBSYSTEMS:
+            if filename.startswith(prefixes):
+                return subsystem, '{}:{}'.format(filename, frame.lineno)
+        return 'other', '{}:{}'.format(filename, frame.lineno)
+    return 'other', '<outside src>'
+
+
+def group_sites(statistics):
+    """ sums the sizes of tracemalloc statistics (grouped by 'traceback') per subsystem and allocation site """
+    sites = defaultdict(lambda: defaultdict(int))
+    for stat in statistics:
+        subsystem, site = get_site(stat.traceback)
+        sites[subsystem][site] += stat.size_diff if isinstance(stat, tracemalloc.StatisticDiff) else stat.size
+    return sites
+
+
+def count_generators():
+    """ returns the number of live generators, the simpy processes of the simulation are generators """
+    return sum(1 for obj in gc.get_objects() if type(obj) is types.GeneratorType)
+
+
+def make_replay_memory(capacity):
+    """ returns a ReplayMemory and a function storing a step as experience as in DDQNAgent.train """
+    import torch
+    from agent.DDQN import ReplayMemory, Experience
+    memory = ReplayMemory(capacity)
+
+    def store(state, action, next_state, reward, done, next_mask):
+        memory.store(Experience(torch.FloatTensor([state]), torch.tensor([action], dtype=torch.int64),
+            torch.FloatTensor([next_state]), torch.FloatTensor([reward]), torch.tensor([done], dtype=torch.int32),
+            torch.from_numpy(next_mask).unsqueeze(0)))
+    return memory, store
+
+
+# the tensors of the experiences are allocated in make_replay_memory
+_lines, _start = inspect.getsourcelines(make_replay_memory)
+REPLAY_LINES = range(_start, _start + len(_lines))
+
+
+def run_episode(env, store=None):
+    """ runs one episode with random valid actions """
+    state = env.reset()
+    mask = env.get_action_mask()
+    done = False
+    while not done:
+        action = int(env.action_space.np_random.choice(np.flatnonzero(mask)))
+        next_state, reward, done, info = env.step(action)
+        if store is not None:
+            store(state, action, next_state, reward, done, info['action_mask'])
+        state, mask = next_state, info['action_mask']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--episodes', type=int, default=50, help='measured episodes')
+    parser.add_argument('--warmup', type=int, default=10, help='episodes before the measurement, at least until the replay memory is full')
+    parser.add_argument('--threshold', type=float, default=4.0, help='allowed growth per episode in KB')
+    parser.add_argument('--top', type=int, default=5, help='allocation sites per subsystem')
+    parser.add_argument('--production-system', default='ProductionSystem1')
+    parser.add_argument('--replay', action='store_true', help='store the experiences in a ReplayMemory')
+    parser.add_argument('--buffer', type=int, default=1000, help='capacity of the ReplayMemory')
+    parser.add_argument('--frames', type=int, default=10, help='most recent frames stored per allocation')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format='%(simtime)6d %(message)s')
+    random.seed(0)
+    np.random.seed(0)
+
+    env = SimEnvIH(System(use_case = "ih", production_system = getattr(ProductionExamples, args.production_system)()))
+    env.action_space.seed(0)
+    memory, store = make_replay_memory(args.buffer) if args.replay else (None, None)
+
+    # the replay memory grows until it is full, the measurement starts afterwards
+    tracemalloc.start(args.frames)
+    warmup = 0
+    while warmup < args.warmup or (memory is not None and memory.memory_counter < memory.capacity):
+        run_episode(env, store)
+        warmup += 1
+    gc.collect()
+    start_snapshot = tracemalloc.take_snapshot()
+    generators_start = count_generators()
+
+    traced = []
+    for _ in range(args.episodes):
+        run_episode(env, store)
+        gc.collect()
+        traced.append(tracemalloc.get_traced_memory()[0])
+    end_snapshot = tracemalloc.take_snapshot()
+    generators_end = count_generators()
+    tracemalloc.stop()
+
+    # steady-state growth: slope of the traced memory after each episode, robust against the size of the last episode
+    growth = np.polyfit(np.arange(len(traced)), traced, 1)[0] if len(traced) > 1 else 0.0
+    filters = [tracemalloc.Filter(False, tracemalloc.__file__)]
+    current = group_sites(end_snapshot.filter_traces(filters).statistics('traceback'))
+    diffs = group_sites(end_snapshot.filter_traces(filters).compare_to(start_snapshot.filter_traces(filters), 'traceback'))
+
+    for subsystem in ['sim', 'env', 'converter', 'replay', 'other']:
+        if subsystem not in current and subsystem not in diffs:
+            continue
+        print('{}: {:.1f} KB allocated, {:+.2f} KB per episode'.format(subsystem,
+            sum(current[subsystem].values()) / 1024, sum(diffs[subsystem].values()) / 1024 / args.episodes))
+        for site, size in sorted(current[subsystem].items(), key=lambda item: -item[1])[:args.top]:
+            print('    {:<44} {:10.1f} KB  {:+8.2f} KB per episode'.format(site, size / 1024, diffs[subsystem][site] / 1024 / args.episodes))
+
+    print('live generators: {} -> {} ({:+.2f} per episode)'.format(generators_start, generators_end,
+        (generators_end - generators_start) / args.episodes))
+    ok = growth <= args.threshold * 1024
+    print('traced memory: {:.1f} KB, growth {:+.2f} KB per episode, threshold {:.1f} KB  {}'.format(
+        traced[-1] / 1024, growth / 1024, args.threshold, 'ok' if ok else 'FAILED'))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
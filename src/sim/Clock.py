@@ -1,23 +1,25 @@
 from sim.CoreObject import CoreObject
+from sim.TickEnvironment import PHASE_CLOCK
 
 
 class Clock(CoreObject):
     '''
-    Simple clock, ticks each hour, stops the machines on weekend, no interaction with maintenance
+    Simple clock, wakes up at the shift boundaries, stops the machines on weekend, no interaction with maintenance
     '''
     def __init__(self, id, system, step_duration):
         
         super().__init__(id, system)
         
         self.step_duration = step_duration
-        self.steps_per_hour = 1 / self.step_duration
+        # in whole ticks, at least one tick if a step is longer than an hour
+        self.steps_per_hour = max(1, int(1 / self.step_duration))
         
         #start clock as soon as it is initialized
         self.action = self.sim_env.process(self.run())
         
     def run(self):
         '''
-        runs the clock, ticks each hour, stops work (but not maintenance) on weekend if weekend_on = true
+        runs the clock, sleeps until the next shift boundary, stops work (but not maintenance) on weekend if weekend_on = true
         '''
         #run as long as simulation
         while True:
@@ -34,8 +36,7 @@ class Clock(CoreObject):
                         machine.process.interrupt(cause='from_clock')
                 
                 # wait until work_start_mon - 1h
-                while not self.weekly_schedule.is_it_worktime(steps_for_process=self.steps_per_hour):
-                    yield self.sim_env.timeout(self.steps_per_hour)
+                yield self.sim_env.timeout_phase(max(0, self.weekly_schedule.get_time_to_next_shift() - self.steps_per_hour), PHASE_CLOCK)
                 # reset machine interrupts after weekend
                 for machine in self.system.machines:
                     #only if the interrupt_origin given by the clock
@@ -46,9 +47,7 @@ class Clock(CoreObject):
                             extra = {'simtime': self.sim_env.now})
                     
                 # wait until work_start_mon
-                yield self.sim_env.timeout(self.steps_per_hour)
+                yield self.sim_env.timeout_phase(self.steps_per_hour, PHASE_CLOCK)
             else:    
-                # wait one hour
-                yield self.sim_env.timeout(self.steps_per_hour)
-                # for machine in self.system.machines:
-                #    self.logger.debug('{} status: {}'.format(machine.id, machine.status), extra = {'simtime': self.sim_env.now})
\ No newline at end of file
+                # wait until the next break starts
+                yield self.sim_env.timeout_phase(self.weekly_schedule.get_worktime_left(), PHASE_CLOCK)
\ No newline at end of file
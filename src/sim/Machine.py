@@ -1,7 +1,7 @@
-from numpy.core.numeric import _frombuffer
 import simpy
 import numpy as np
 from sim.CoreObject import CoreObject
+from sim.TickEnvironment import PHASE_DEGRADE, PHASE_REPAIR, PHASE_PRODUCTION, PHASE_ASSIGNMENT
 
 
 class Machine(CoreObject):
@@ -9,6 +9,8 @@ class Machine(CoreObject):
     def __init__(self, id, system, machine_type, output_buffer_capacity):
         
         super().__init__(id, system)
+        # index of this machine in the KPIs of the system, updated with each status change
+        self.kpi_index = self.system.kpis.add(self)
         
         # machine properties
         self.output_buffer_capacity = output_buffer_capacity
@@ -26,15 +28,18 @@ class Machine(CoreObject):
         # set initial machine state
         self.health = 0
         self.failed = False
-        self.status = None # current values:'working', 'waiting', 'failed', 'weekend', 'under_repair', 'scheduled_maintenance', 'repair_finished'
+        # event the working process sleeps on while the machine is idle (failed, weekend, under_repair)
+        self.resume_event = None
+        # event the working process sleeps on while the output buffer is full
+        self.output_buffer_event = None
+        # set without the status setter, the KPIs count from the first status set by working()
+        self._status = None # current values:'working', 'waiting', 'failed', 'weekend', 'under_repair', 'scheduled_maintenance', 'repair_finished'
         
         self.product = None
         self.assigned_task = None
         self.production_state = 'waiting_for_product_assignment'
         self.starting_machine = False
         
-        self.epsilon = self.system.epsilon
-        
         # set the production_store as default, for starting_machine decide separately in working()
         self.store = self.system.production_store
         # check if machine can start new products and which tasks can be run on this machine
@@ -48,8 +53,10 @@ class Machine(CoreObject):
                 self.logger.debug('{} can start products'.format(self.id), extra={"simtime": self.sim_env.now})
                 break
                 
-        # Threshold where machine requests CBM
-        self.CBM_threshold=6
+        # Threshold where machine requests CBM, 6 unless the system defines one for this machine
+        self.CBM_threshold = 6
+        if self.system.cbm_thresholds is not None:
+            self.CBM_threshold = self.system.cbm_thresholds.get(self.id, self.CBM_threshold)
         # set maintenance request and repair_type based on initial health
         if self.CBM_threshold <= self.health < 10:
             self.request_maintenance = True
@@ -70,6 +77,19 @@ class Machine(CoreObject):
         if self.system.degradation_on:
             self.failing = self.sim_env.process(self.degrade())
 
+    @property
+    def status(self):
+        return self._status
+
+    @status.setter
+    def status(self, status):
+        """ sets the status, updates the KPIs and wakes the working process if it sleeps because the machine was idle """
+        changed = status != getattr(self, '_status', None)
+        self._status = status
+        self.system.kpis.update(self.kpi_index, status, self.production_state, self.repair_type)
+        if changed and self.resume_event is not None and not self.resume_event.triggered:
+            self.resume_event.succeed()
+
     def can_do_next_task(self, product):
         """ checks if this machine can do the next task of a given product """
         if product.next_task in self.tasks:
@@ -122,9 +142,16 @@ class Machine(CoreObject):
             try:
                 # if this machine is ready to work on a product
                 if self.status in [None, 'working', 'waiting', 'repair_finished']:
+                    # production continues in the production and assignment phases, e.g. a repaired machine rejoins production in the next tick
+                    if self.sim_env.phase > PHASE_ASSIGNMENT:
+                        yield self.sim_env.timeout_phase(self.sim_env.phase_tick(PHASE_PRODUCTION) - self.sim_env.now, PHASE_PRODUCTION)
+                    
                     # first assign a product
                     if self.production_state == 'waiting_for_product_assignment':
                         self.status = 'waiting'
+                        # products are picked up after all hand-overs of the tick
+                        if self.sim_env.phase < PHASE_ASSIGNMENT:
+                            yield self.sim_env.timeout_phase(0, PHASE_ASSIGNMENT)
                         
                         if self.use_case == 'ih':
                             # if this machine can start products of a type
@@ -146,6 +173,10 @@ class Machine(CoreObject):
                                 with self.store.get(filter=lambda product: self.can_do_next_task(product)) as get_request:
                                     self.product = yield get_request
                             
+                        # the product left the output buffer of its previous machine, which might wait for space there
+                        if self.product.previous_machine is not None:
+                            self.system.machines_by_id[self.product.previous_machine].notify_output_buffer()
+                            
                         # set process time here to not have it begin anew if the machine gets interrupted during processing a part
                         self.remaining_process_time = self.tasks[self.product.next_task]
                         self.logger.debug("{} Part from store assigned, type {}, due_date: {}, task: {}".format(self.id,
@@ -157,16 +188,16 @@ class Machine(CoreObject):
                     if self.production_state == 'processing_part':
                         self.status = 'working'
                         
-                        # wait for what is left of the remaining_process_time
-                        while self.remaining_process_time:
-                            self.logger.debug('{} working on product of type {} and due_date {}, time left : {}'.format(self.id, self.product.product_type, self.product.due_date, self.remaining_process_time), extra = {'simtime': self.sim_env.now})
-                            if self.remaining_process_time == self.tasks[self.product.next_task]:
-                                yield self.sim_env.timeout(1 - self.epsilon)
-                            else:
-                                yield self.sim_env.timeout(1)
-                            self.remaining_process_time -= 1
-                        
-                        yield self.sim_env.timeout(self.epsilon)
+                        # wait for what is left of the remaining_process_time in one timeout, the task is handed over in the production phase
+                        self.logger.debug('{} working on product of type {} and due_date {}, time left : {}'.format(self.id, self.product.product_type, self.product.due_date, self.remaining_process_time), extra = {'simtime': self.sim_env.now})
+                        process_end = self.sim_env.phase_tick(PHASE_ASSIGNMENT) + self.remaining_process_time
+                        try:
+                            yield self.sim_env.timeout_phase(process_end - self.sim_env.now, PHASE_PRODUCTION)
+                        except simpy.Interrupt:
+                            # only completed ticks count, the interrupted one has to be repeated
+                            self.remaining_process_time = process_end - self.sim_env.now
+                            raise
+                        self.remaining_process_time = 0
                         self.logger.debug('{} finished working on product of type {} and due_date {}'.format(self.id, self.product.product_type, self.product.due_date), extra = {'simtime': self.sim_env.now})
                         
                         # 'tell' the product this task was finished
@@ -189,7 +220,12 @@ class Machine(CoreObject):
                         while self.output_buffer_capacity != float('inf') and self.calculate_output_buffer_size() >= self.output_buffer_capacity:
                             self.logger.debug('{} waiting for space in output buffer of capacity {}, product of type {} and due_date {}'.format(self.id,
                                 self.output_buffer_capacity, self.product.product_type, self.product.due_date), extra = {'simtime': self.sim_env.now})
-                            yield self.sim_env.timeout(1)
+                            # sleep until a product leaves the output buffer instead of checking it each time unit
+                            self.output_buffer_event = self.sim_env.event()
+                            yield self.output_buffer_event
+                            self.output_buffer_event = None
+                            # check again in the next tick, like the former polling
+                            yield self.sim_env.timeout_phase(1, PHASE_PRODUCTION)
                             
                         # if there is space in the output buffer, put the product there
                         self.production_state = 'putting_product_in_output_buffer'
@@ -198,6 +234,9 @@ class Machine(CoreObject):
                     # should be guaranteed that there is space in the output_buffer (and production_store) due to previously waiting for space
                     if self.production_state == 'putting_product_in_output_buffer':                        
                         self.status = 'waiting'
+                        # the product is put in the assignment phase, the output buffers of other machines are checked before
+                        if self.sim_env.phase < PHASE_ASSIGNMENT:
+                            yield self.sim_env.timeout_phase(0, PHASE_ASSIGNMENT)
                                                 
                         # since there is space in the output_buffer, there should be space in the production_store, so just put item there
                         with self.system.production_store.put(self.product) as put_request:
@@ -221,11 +260,9 @@ class Machine(CoreObject):
                         
                         # since there is always space in the sink_store, just put item there
                         with self.system.sink_store.put(self.product) as put_request:
-                            # infinite capacity, can delete object before putting it
+                            # infinite capacity, can delete object before putting it, the sink updates the corresponding order
                             self.logger.debug("{} put item in sink store, date {}, task {}, inventory {}".format(self.id,
-                                self.product.due_date, self.product.next_task, len(self.system.sink_store.items)), extra = {"simtime": self.sim_env.now})
-                            # update the corresponding order
-                            self.product.order.finished_products += 1
+                                self.product.due_date, self.product.next_task, self.system.sink_store.total_completed), extra = {"simtime": self.sim_env.now})
                             self.product = None
                             yield put_request
                             
@@ -237,25 +274,22 @@ class Machine(CoreObject):
                         # go back to the start of the production process
                         self.production_state = 'waiting_for_product_assignment'
 
-                elif self.status == 'failed':
-                    # self.logger.debug('{} status {}'.format(self.id, self.status), extra = {'simtime': self.sim_env.now})
-                    yield self.sim_env.timeout(1)
-                
-                elif self.status == 'weekend':
+                elif self.status in ['failed', 'weekend', 'under_repair']:
                     # self.logger.debug('{} status {}'.format(self.id, self.status), extra = {'simtime': self.sim_env.now})
-                    yield self.sim_env.timeout(1)
+                    # sleep until the status changes instead of checking it each time unit
+                    self.resume_event = self.sim_env.event()
+                    yield self.resume_event
+                    self.resume_event = None
                 
                 elif self.status == 'scheduled_maintenance':
                     # self.logger.debug('{} status {}'.format(self.id, self.status), extra = {'simtime': self.sim_env.now})
                     yield self.sim_env.process(self.maintain())
                     # self.logger.debug('{} status {} finished maintenance'.format(self.id, self.status), extra = {'simtime': self.sim_env.now})
-                
-                elif self.status == 'under_repair':
-                    # self.logger.debug('{} status {}'.format(self.id, self.status), extra = {'simtime': self.sim_env.now})
-                    yield self.sim_env.timeout(1)
       
             except simpy.Interrupt as interrupt:
                 
+                self.resume_event = None
+                self.output_buffer_event = None
                 self.logger.debug('{} Interrupted while status {} and with cause {}'.format(self.id, self.status, interrupt.cause), extra = {'simtime': self.sim_env.now})
                 if interrupt.cause == 'from_degrade':
                     self.status = 'failed'
@@ -274,33 +308,28 @@ class Machine(CoreObject):
         
         # break loop once scheduled for maintenance
         self.request_maintenance = False
+        self.system.dispatcher.withdraw(self)
 
-        # stop degradation during maintenance and occupy maintenance resource
+        # stop degradation during maintenance and occupy maintenance resource (waits if all crews are busy)
         self.status = 'under_repair' 
-        self.system.available_maintenance -= 1
+        crew = self.system.dispatcher.crews.request()
+        yield crew
 
         # set time to repair based on repair_type
         self.time_to_repair = self.repair_durations[self.repair_type]
         
-        # wait for repair to finish
-        for i in range(self.time_to_repair):
-            if i < self.time_to_repair - 1:
-                try:
-                    self.logger.debug('{} is maintaining, time left: {}'.format(self.id, self.time_to_repair - i), extra={'simtime': self.sim_env.now})
-                    yield self.sim_env.timeout(1)
-                except simpy.Interrupt:
-                    # ignore interruptions, repair time is fixed
-                    yield self.sim_env.timeout(1)
-            else:
-                try:
-                    self.logger.debug('{} is maintaining, shorter timeout, time left: {}'.format(self.id, self.time_to_repair - i), extra={'simtime': self.sim_env.now})
-                    yield self.sim_env.timeout(1-self.epsilon)
-                except simpy.Interrupt:
-                    # ignore interruptions, repair time is fixed
-                    yield self.sim_env.timeout(1-self.epsilon)
+        # wait for repair to finish in one timeout, the repair is completed in the repair phase of its last tick
+        self.logger.debug('{} is maintaining, time left: {}'.format(self.id, self.time_to_repair), extra={'simtime': self.sim_env.now})
+        repair_end = self.sim_env.phase_tick(PHASE_REPAIR) + self.time_to_repair - 1
+        while self.sim_env.now < repair_end or self.sim_env.phase < PHASE_REPAIR:
+            try:
+                yield self.sim_env.timeout_phase(repair_end - self.sim_env.now, PHASE_REPAIR)
+            except simpy.Interrupt:
+                # ignore interruptions, repair time is fixed
+                pass
             
         # release maintenance resource before waiting for monday
-        self.system.available_maintenance += 1
+        self.system.dispatcher.crews.release(crew)
         self.maintenance_request = None
         
         # declare machine repaired
@@ -316,14 +345,17 @@ class Machine(CoreObject):
             self.logger.debug("{} maintenace finished -> working".format(self.id), extra={"simtime": self.sim_env.now})
             self.status = 'repair_finished'
         self.logger.debug("{} Machine.maintain() completed".format(self.id), extra = {"simtime": self.sim_env.now})
-        yield self.sim_env.timeout(self.epsilon)
          
     def degrade(self):
         """ Machine degrades based on a discrete state Markovian degradation process. """
 
         while True:
             try:
-                yield self.sim_env.timeout(self.epsilon)
+                # degrade in the degradation phase of each tick, starting with the current one
+                if self.sim_env.phase == PHASE_DEGRADE:
+                    yield self.sim_env.timeout_phase(1, PHASE_DEGRADE)
+                else:
+                    yield self.sim_env.timeout_phase(self.sim_env.phase_tick(PHASE_DEGRADE) - self.sim_env.now, PHASE_DEGRADE)
                 if self.status in [None, 'working']:
                     self.logger.debug("{} Machine.degrade() started with status: {}".format(self.id, self.status), extra = {"simtime": self.sim_env.now})
                     # yield self.sim_env.timeout(1)
@@ -335,8 +367,7 @@ class Machine(CoreObject):
                     if ((self.health == self.failed_state) and (not self.failed)):
                         self.failed = True
                         self.request_maintenance = True
-                        if self not in self.system.machines_to_repair:
-                            self.system.machines_to_repair.append(self)
+                        self.system.dispatcher.request(self)
                         self.logger.debug("{} Worn out. Product is {}".format(self.id, self.product), extra = {"simtime": self.sim_env.now})
                         # variable to decide where the interruption comes from
                         self.interrupt_origin = 'from_degrade'
@@ -348,21 +379,20 @@ class Machine(CoreObject):
                         and (not self.request_maintenance)):
                         # CBM threshold reached, request repair
                         self.request_maintenance = True
-                        if self not in self.system.machines_to_repair:
-                            self.system.machines_to_repair.append(self)
+                        self.system.dispatcher.request(self)
                         self.repair_type = "CBM"
                     
                     self.logger.debug("{} Machine.degrade() completed".format(self.id), extra = {"simtime": self.sim_env.now})
-                    yield self.sim_env.timeout(1)
-
-                else:
-                    #self.logger.debug("{} did not degrade because status is {}".format(self.id, self.status), extra = {"simtime": self.sim_env.now})
-                    yield self.sim_env.timeout(1)
             except simpy.Interrupt as interrupt:
                 # interruptions to degrade should not happen at all
                 self.logger.debug("{} Degradation interrupted by {}".format(self.id, interrupt.cause), extra = {"simtime": self.sim_env.now})
                 
 
+    def notify_output_buffer(self):
+        """ wakes the working process if it sleeps because the output buffer was full """
+        if self.output_buffer_event is not None and not self.output_buffer_event.triggered:
+            self.output_buffer_event.succeed()
+
     def _generate_degradation_matrix(self, q, dim=10):
         """
         Creates discrete Markovian degradation matrix with given degradation rate 
@@ -0,0 +1,104 @@
+import numpy as np
+
+
+# states of a machine for the KPIs: its status, 'waiting' split by the production_state into starved (waiting for a product)
+# and blocked (waiting for space in the output buffer), None counts as idle. 'repair_finished' counts as under_repair:
+# a repair is completed in the repair phase of its last tick, which is still a repair tick (like in RewardR2)
+STATES = ('working', 'starved', 'blocked', 'idle', 'failed', 'scheduled_maintenance', 'under_repair', 'weekend')
+UP_STATES = ('working', 'starved', 'blocked', 'idle')
+DOWN_STATES = ('failed', 'scheduled_maintenance', 'under_repair')
+STATE_INDEX = {state: i for i, state in enumerate(STATES)}
+STARVED, BLOCKED, IDLE, FAILED, UNDER_REPAIR = (STATE_INDEX[state] for state in ['starved', 'blocked', 'idle', 'failed', 'under_repair'])
+# production states of a waiting machine that has a product it can not hand over yet
+BLOCKED_PRODUCTION_STATES = ('waiting_for_output_buffer', 'putting_product_in_output_buffer', 'putting_product_in_sink_store')
+
+
+class MachineKPIs():
+    """
+    KPIs of the machines of a System, updated with each status change of a machine (Machine.status setter) at O(1):
+    time in each state, failures, started CBM and CM repairs, finished repairs and their duration. Times are in ticks.
+    """
+    def __init__(self, sim_env):
+        self.sim_env = sim_env
+        self.machines = []
+        self.state = []
+        self.since = []
+        self.time = []
+        self.failures = []
+        self.repairs = {'cbm': [], 'cm': []}
+        self.finished_repairs = []
+        self.repair_time = []
+
+    def add(self, machine):
+        """ adds a machine (in no state yet: -1), returns its index """
+        self.machines.append(machine)
+        self.state.append(-1)
+        self.since.append(self.sim_env.now)
+        self.time.append([0] * len(STATES))
+        self.failures.append(0)
+        for repairs in self.repairs.values():
+            repairs.append(0)
+        self.finished_repairs.append(0)
+        self.repair_time.append(0)
+        return len(self.machines) - 1
+
+    def update(self, n, status, production_state, repair_type):
+        """ accounts the time of machine n in its previous state if the state changed, counts failures and repairs """
+        if status == 'waiting':
+            state = BLOCKED if production_state in BLOCKED_PRODUCTION_STATES else STARVED
+        elif status is None:
+            state = IDLE
+        elif status == 'repair_finished':
+            state = UNDER_REPAIR
+        else:
+            state = STATE_INDEX[status]
+        previous = self.state[n]
+        if state == previous:
+            return
+
+        now = self.sim_env.now
+        if previous >= 0:
+            self.time[n][previous] += now - self.since[n]
+            if previous == UNDER_REPAIR:
+                self.finished_repairs[n] += 1
+                self.repair_time[n] += now - self.since[n]
+        self.state[n] = state
+        self.since[n] = now
+
+        if state == FAILED:
+            self.failures[n] += 1
+        elif state == UNDER_REPAIR and repair_type in self.repairs:
+            self.repairs[repair_type][n] += 1
+
+    def get_time(self):
+        """ time of each machine in each state until now (including the current one), shape (machines, len(STATES)) """
+        time = np.array(self.time, dtype=float).reshape(len(self.machines), len(STATES))
+        state = np.array(self.state, dtype=np.int64)
+        machines = np.flatnonzero(state >= 0)
+        time[machines, state[machines]] += self.sim_env.now - np.array(self.since, dtype=float)[machines]
+        return time
+
+    def as_arrays(self):
+        """
+        Returns the KPIs as arrays with one entry per machine:
+        time_<state>, availability (up time / time without weekends), downtime (failed, waiting for and under repair),
+        failures, cbm and cm (started repairs), mtbf (up time per failure, inf without failures),
+        mttr (duration of the finished repairs per finished repair, including waiting for a crew and the tick in which the
+        repair completes; a repair counts once the machine leaves it, not while it is running; nan without finished repairs)
+        """
+        time = self.get_time()
+        kpis = {'time_' + state: time[:, i] for i, state in enumerate(STATES)}
+        up = time[:, [STATE_INDEX[state] for state in UP_STATES]].sum(axis=1)
+        downtime = time[:, [STATE_INDEX[state] for state in DOWN_STATES]].sum(axis=1)
+        failures = np.array(self.failures, dtype=float)
+        finished_repairs = np.array(self.finished_repairs, dtype=float)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            kpis['availability'] = up / (up + downtime)
+            kpis['mtbf'] = np.where(failures > 0, up / failures, np.inf)
+            kpis['mttr'] = np.where(finished_repairs > 0, np.array(self.repair_time, dtype=float) / finished_repairs, np.nan)
+        kpis['downtime'] = downtime
+        kpis['failures'] = np.array(self.failures)
+        kpis['cbm'] = np.array(self.repairs['cbm'])
+        kpis['cm'] = np.array(self.repairs['cm'])
+        return kpis
@@ -0,0 +1,93 @@
+import heapq
+import itertools
+
+import simpy
+
+
+def request_time_priority(machine, request_time):
+    """ first come, first served """
+    return (request_time,)
+
+def health_priority(machine, request_time):
+    """ worst health first """
+    return (-machine.health, request_time)
+
+def cm_first_priority(machine, request_time):
+    """ failed machines (CM) before CBM requests """
+    return (0 if machine.failed else 1, request_time)
+
+def bottleneck_priority(machine, request_time):
+    """ machines with the longest process time (the bottleneck of their line) first """
+    return (-max(machine.tasks.values()), request_time)
+
+
+PRIORITIES = {
+    'request_time': request_time_priority,
+    'health': health_priority,
+    'cm_first': cm_first_priority,
+    'bottleneck': bottleneck_priority,
+}
+
+
+class MaintenanceDispatcher():
+    """
+    Queue of the maintenance requests of the machines as heap, ordered by a priority key (one of PRIORITIES or
+    a function (machine, request_time) -> tuple, smaller first) and the maintenance crews as simpy.Resource.
+    A repair holds one crew while it runs, repairs that request a crew while all are busy wait until one is released.
+    """
+    def __init__(self, sim_env, capacity, priority='request_time'):
+        self.sim_env = sim_env
+        self.crews = simpy.Resource(sim_env, capacity=capacity)
+        self.priority = PRIORITIES[priority] if isinstance(priority, str) else priority
+
+        # heap of [key, counter, machine], entries of withdrawn requests are marked with machine None
+        self.heap = []
+        self.entries = {}
+        self.request_times = {}
+        self.counter = itertools.count()
+
+    @property
+    def available(self):
+        """ number of crews that are not repairing """
+        return self.crews.capacity - self.crews.count
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, machine):
+        return machine in self.entries
+
+    def request(self, machine):
+        """ adds the maintenance request of a machine, a repeated request updates its priority (keeping its request time) """
+        request_time = self.request_times.setdefault(machine, self.sim_env.now)
+        key = self.priority(machine, request_time)
+        entry = self.entries.get(machine)
+        if entry is not None:
+            if entry[0] == key:
+                return
+            entry[-1] = None
+        entry = [key, next(self.counter), machine]
+        self.entries[machine] = entry
+        heapq.heappush(self.heap, entry)
+
+    def withdraw(self, machine):
+        """ removes the request of a machine, e.g. because it is being repaired """
+        entry = self.entries.pop(machine, None)
+        if entry is not None:
+            entry[-1] = None
+            del self.request_times[machine]
+
+    def peek(self):
+        """ returns the machine with the highest priority without removing it, None if there are no requests """
+        while self.heap and self.heap[0][-1] is None:
+            heapq.heappop(self.heap)
+        return self.heap[0][-1] if self.heap else None
+
+    def pop(self):
+        """ removes and returns the machine with the highest priority, None if there are no requests """
+        machine = self.peek()
+        if machine is not None:
+            heapq.heappop(self.heap)
+            del self.entries[machine]
+            del self.request_times[machine]
+        return machine
@@ -13,7 +13,8 @@ class Order(CoreObject):
         self.production_system = self.system.production_system
         self.source_store = self.system.source_store
         
-        self.id = 'O' + str(len(self.system.orders))
+        self.id = 'O' + str(self.system.order_counter)
+        self.system.order_counter += 1
         
         # order specific parameters
         # products_to_order is a dict in the form {product_type: amount}
@@ -36,11 +37,13 @@ class Order(CoreObject):
         # if there were no products ordered, stop simulation
         assert len(self.products) > 0, 'Received an order with 0 products in it.'
         
-        # track how many items are finished to save time in is_finished()
+        # track how many items are finished to save time in is_finished(), updated by the SinkStore
         self.finished_products = 0
+        self.late_products = 0
+        self.total_lateness = 0
         
-        # save this order in the system
-        self.system.orders.append(self)
+        # save this order in the system until it is finished
+        self.system.orders[self.id] = self
                 
     def is_finished(self):
         """ Returns if this order is finished. Once it is finished, it can not go back into an unfinished state. """
@@ -1,5 +1,7 @@
+import math
 import random
 from sim.Order import Order
+from sim.TickEnvironment import PHASE_ARRIVAL
 
 
 class OrderGenerator:
@@ -39,35 +41,45 @@ class OrderGenerator:
     
     def generate_order_process_probability(self, order_probability_step):
         """creates a process that runs during the simulation that puts items in the source_store at random
-        (with order_probability_step {product_type: chance to be ordered in each step})"""
+        (with order_probability_step {product_type: chance to be ordered in each step}).
+        Instead of one random number per product type and step, the steps until the next order of each
+        product type are drawn from the geometric distribution, which gives the same arrival process."""
+        # first step in which each product type is ordered
+        next_arrival = {}
+        for product_type in self.system.production_system.product_types:
+            assert product_type in order_probability_step, 'Found a product type in the system without a probability of being ordered.'
+            next_arrival[product_type] = self.system.sim_env.now + self._steps_until_order(order_probability_step[product_type]) - 1
         while True:
+            step = min(next_arrival.values())
+            if step == float('inf'):
+                return
+            if step > self.system.sim_env.now:
+                yield self.system.sim_env.timeout_phase(step - self.system.sim_env.now, PHASE_ARRIVAL)
+            # TODO: could integrate putting more than one item per product_type in each step
             products_to_order = {}
-            order_something = False
-            # TODO: change this filler process to own random process of receiving orders
-            # amount = random.randint(1,10)
-            # if chance hits, put a product in the source_store
-            for product_type in self.system.production_system.product_types:
-                assert product_type in order_probability_step, 'Found a product type in the system without a probability of being ordered.'
-                # TODO: could integrate putting more than one item per product_type in each step
-                rand = random.random()
-                if rand < order_probability_step[product_type]:
+            for product_type in next_arrival:
+                if next_arrival[product_type] == step:
                     products_to_order[product_type] = 1
-                    order_something = True
-            if order_something:
-                due_date = random.randint(self.system.sim_env.now, self.system.simulation_time)
-                Order(products_to_order = products_to_order, due_date = due_date, system = self.system, order_date = self.system.sim_env.now)
-            yield self.system.sim_env.timeout(1)        
-    
+                    next_arrival[product_type] += self._steps_until_order(order_probability_step[product_type])
+            due_date = random.randint(self.system.sim_env.now, self.system.simulation_time)
+            Order(products_to_order = products_to_order, due_date = due_date, system = self.system, order_date = self.system.sim_env.now)
+
+    def _steps_until_order(self, probability):
+        """ number of steps until the next success of a chance with the given probability in each step (at least 1) """
+        if probability <= 0:
+            return float('inf')
+        if probability >= 1:
+            return 1
+        return math.floor(math.log(1 - random.random()) / math.log(1 - probability)) + 1
+
     def generate_order_process_list(self, order_list):
         """ creates a process that runs during the simulation that puts items in the source_store
         based on a given list of triples (put_date, due_date, {product_type: amount}) """
-        # put products in order_list in the source_store at their put_date
-        while True:
-            self.system.logger.debug('Order_list: {}'.format(order_list), extra = {'simtime': self.system.sim_env.now})
-            for tup in order_list:
-                if tup[0] == self.system.sim_env.now:
-                    Order(products_to_order = tup[2], due_date = tup[1], system = self.system, order_date = self.system.sim_env.now)
-                    #self.store.put(Product(product_type=tup[2], production_system=self.system.production_system, due_date=tup[1]))
-                    self.system.logger.debug('Put order {} with due_date {}'.format(tup[2], tup[1]), extra={'simtime': self.system.sim_env.now})
-                    #order_list.remove(tup)
-            yield self.system.sim_env.timeout(1)
+        # sort the order_list once by put_date, then wait for the next put_date
+        self.system.logger.debug('Order_list: {}'.format(order_list), extra = {'simtime': self.system.sim_env.now})
+        pending = sorted((tup for tup in order_list if tup[0] >= self.system.sim_env.now), key=lambda tup: tup[0])
+        for tup in pending:
+            if tup[0] > self.system.sim_env.now:
+                yield self.system.sim_env.timeout_phase(tup[0] - self.system.sim_env.now, PHASE_ARRIVAL)
+            Order(products_to_order = tup[2], due_date = tup[1], system = self.system, order_date = self.system.sim_env.now)
+            self.system.logger.debug('Put order {} with due_date {}'.format(tup[2], tup[1]), extra={'simtime': self.system.sim_env.now})
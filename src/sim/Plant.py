@@ -0,0 +1,50 @@
+import logging
+
+from sim.TickEnvironment import TickEnvironment
+from sim.System import System
+from sim.MaintenanceDispatcher import MaintenanceDispatcher
+
+
+class Plant():
+    """
+    Several production lines (one System per ProductionSystem) simulated in one TickEnvironment, sharing
+    maintenance_capacity maintenance resources. Can be used like a System by SimEnvPlant and the heuristics:
+    machines, available_maintenance and the dispatcher cover all lines.
+    """
+    def __init__(self, production_systems, maintenance_capacity, simulation_time=400, maintenance_priority='request_time'):
+        self.logger = logging.getLogger("factory_sim")
+        self.maintenance_capacity = maintenance_capacity
+        self.simulation_time = simulation_time
+        self.maintenance_priority = maintenance_priority
+
+        # the lines are initialized with this environment once when they are created, again in initialize()
+        self.sim_env = TickEnvironment()
+        self.dispatcher = MaintenanceDispatcher(self.sim_env, self.maintenance_capacity, priority=self.maintenance_priority)
+        self.lines = [System(use_case = "ih", production_system = production_system, plant = self) for production_system in production_systems]
+
+        self.weekend_on = self.lines[0].weekend_on
+        assert all(line.weekend_on == self.weekend_on for line in self.lines), 'Tried to create a plant with lines with and without weekends.'
+
+        self.initialize()
+        self.logger.debug("Plant with {} lines successfully initialized".format(len(self.lines)), extra = {"simtime": self.sim_env.now})
+
+    def initialize(self):
+        """ Initializes all lines for a new simulation in one new environment, supposed to be called in SimEnvPlant.reset() """
+        self.sim_env = TickEnvironment()
+        self.dispatcher = MaintenanceDispatcher(self.sim_env, self.maintenance_capacity, priority=self.maintenance_priority)
+
+        self.machines = []
+        for line in self.lines:
+            line.simulation_time = self.simulation_time
+            line.initialize()
+            self.machines.extend(line.machines)
+        self.weekly_schedule = self.lines[0].weekly_schedule
+
+    @property
+    def available_maintenance(self):
+        """ free maintenance resources of the plant """
+        return self.dispatcher.available
+
+    def get_parts_produced(self):
+        """ returns the number of finished products of all lines """
+        return sum(line.sink_store.total_completed for line in self.lines)
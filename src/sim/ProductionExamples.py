@@ -1,4 +1,3 @@
-import numpy as np
 from collections import OrderedDict
 
 from sim.ProductionSystem import ProductionSystem
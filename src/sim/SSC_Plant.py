@@ -0,0 +1,27 @@
+import gym
+from gym.spaces import utils
+import numpy as np
+
+from sim.SSC_IH import SimulationStateConverterIH
+
+
+class SimulationStateConverterPlant():
+    """
+    SimulationStateConverter for a Plant, concatenates the observations (machine health and buffer sizes) of all lines.
+    """
+    def __init__(self, plant):
+        self.system = plant
+        self.machines = plant.machines
+        self.converters = [SimulationStateConverterIH(line) for line in plant.lines]
+
+        spaces = [utils.flatten_space(converter.observation_space) for converter in self.converters]
+        self.observation_space = gym.spaces.Box(low = np.concatenate([space.low for space in spaces]),
+                                                high = np.concatenate([space.high for space in spaces]), dtype=spaces[0].dtype)
+
+    def get_observation_dims(self):
+        """returns the obervation dims"""
+        return utils.flatdim(self.observation_space)
+
+    def system_state_to_observation(self):
+        """ Get observation from the simpy systems of all lines """
+        return np.concatenate([converter.system_state_to_observation() for converter in self.converters])
@@ -1,4 +1,5 @@
 import logging
+from itertools import accumulate
 
 
 class Schedule:
@@ -21,6 +22,15 @@ class Schedule:
         #sunday + saturday + monday
         self.steps_per_weekend = self.steps_per_day + ((24 - self.work_end_sat) + (self.work_start_mon)) / step_duration
         
+        # precompute the weekly pattern of work (True) and break (False) steps, twice to look ahead across the end of a week
+        week = [self._is_worktime_in_week(step) for step in range(self.steps_per_week)]
+        self.worktime_calendar = week + week
+        # prefix sums of work steps to count the work steps in any interval in O(1)
+        self.worktime_prefix_sums = [0] + list(accumulate(self.worktime_calendar))
+        # for each step of the week, number of steps until the next break starts / the next shift starts
+        self.steps_to_break = self._steps_to_change(False)
+        self.steps_to_shift = self._steps_to_change(True)
+        
         self.logger = logging.getLogger("factory_sim")
         
         self.logger.debug("Schedule successfully created.", extra = {"simtime": sim_env.now})
@@ -43,17 +53,12 @@ class Schedule:
         self.logger.debug("clock: {}:{}, day: {}, week: {}, working: {}".format(current_hour_in_day,
             current_minute, current_day, current_week, working), extra = {"simtime": self.sim_env.now})
         
-    def is_it_worktime(self, steps_for_process=0):
+    def _is_worktime_in_week(self, step):
         """
-        Checks if now + steps_for_process is time to work (True) or weekend (False). Always returns True if not production_system.weekend_on.
+        Checks if the given step of a week (step 0 is monday, work_start_mon) is time to work (True) or weekend (False).
+        Only used to precompute the weekly calendar.
         """
-        
-        # if weekend are not wanted in simulation, it is always time to work
-        if not self.weekend_on:
-            return True
-    
-        current_step = self.sim_env.now + steps_for_process
-        current_hour = 6 + current_step * self.step_duration # can lead to float hours
+        current_hour = self.work_start_mon + step * self.step_duration
         current_hour_in_day = current_hour % 24
         current_hour_in_week = current_hour % 168
         current_day = int(current_hour_in_week / 24)
@@ -71,15 +76,68 @@ class Schedule:
         
         return True
     
+    def _steps_to_change(self, worktime):
+        """
+        Returns a list with the number of steps from each step of the week until the calendar next has the value worktime
+        (0 if it already has this value), inf if it never has it
+        """
+        steps = [float('inf')] * len(self.worktime_calendar)
+        for step in reversed(range(len(self.worktime_calendar))):
+            if self.worktime_calendar[step] == worktime:
+                steps[step] = 0
+            elif step + 1 < len(steps):
+                steps[step] = steps[step + 1] + 1
+        return steps[:self.steps_per_week]
+        
+    def is_it_worktime(self, steps_for_process=0):
+        """
+        Checks if now + steps_for_process is time to work (True) or weekend (False). Always returns True if not production_system.weekend_on.
+        """
+        
+        # if weekend are not wanted in simulation, it is always time to work
+        if not self.weekend_on:
+            return True
+        
+        # shifts start and end at full steps, so the step a point in time falls into decides
+        return self.worktime_calendar[int(self.sim_env.now + steps_for_process) % self.steps_per_week]
+    
     def is_action_within_worktime(self, steps_for_process):
         """
         checks if there is weekend between now and end of process (False)
         True if process not interrupted by weekend between now and now + steps_for_process 
         """
-        for i in range(0, steps_for_process):
-            if not self.is_it_worktime(steps_for_process=i):
-                return False
-        return True
+        if not self.weekend_on:
+            return True
+        if steps_for_process > self.steps_per_week:
+            return False
+        start = int(self.sim_env.now) % self.steps_per_week
+        # number of work steps in [start, start + steps_for_process)
+        work_steps = self.worktime_prefix_sums[start + steps_for_process] - self.worktime_prefix_sums[start]
+        return work_steps == steps_for_process
+    
+    def get_worktime_left(self):
+        """
+        returns the time left (in timesteps) until the next break starts, 0 during a break, inf if there are no weekends
+        """
+        if not self.weekend_on:
+            return float('inf')
+        current_step = int(self.sim_env.now)
+        steps = self.steps_to_break[current_step % self.steps_per_week]
+        if steps == 0:
+            return 0
+        return current_step + steps - self.sim_env.now
+    
+    def get_time_to_next_shift(self):
+        """
+        returns the time left (in timesteps) until the next shift starts, 0 during work time
+        """
+        if not self.weekend_on:
+            return 0
+        current_step = int(self.sim_env.now)
+        steps = self.steps_to_shift[current_step % self.steps_per_week]
+        if steps == 0:
+            return 0
+        return current_step + steps - self.sim_env.now
     
     def get_time_new_week(self):
         """
@@ -43,7 +43,7 @@ class SimulationStateConverter(ABC):
         due_dates = []
         # count all products of all orders (-> also consider products that are currently in machines and not in stores)
         # possible: could adapt this method to not look at products but at orders
-        for order in self.system.orders:
+        for order in self.system.orders.values():
             for product in order.products:
                 due_dates.append(product.due_date)
         return due_dates
@@ -0,0 +1,51 @@
+import simpy
+
+
+class SinkStore(simpy.Store):
+    """
+    Store for finished products. Instead of keeping every product, it counts the completed products per
+    product type (completed, late, total lateness) and updates the counters of their orders, so its memory
+    does not grow with the simulation time. The products themselves are only kept if retain_products is set.
+    Finished orders are removed from the open orders (dict id -> order).
+    """
+    def __init__(self, env, product_types, orders, retain_products=False):
+        super().__init__(env=env, capacity=float('inf'))
+        self.orders = orders
+        self.retain_products = retain_products
+
+        self.total_completed = 0
+        self.completed = {product_type: 0 for product_type in product_types}
+        self.late = {product_type: 0 for product_type in product_types}
+        self.total_lateness = {product_type: 0 for product_type in product_types}
+
+        # orders whose last product arrived in the sink
+        self.completed_orders = 0
+        self.late_orders = 0
+        self.total_order_lateness = 0
+
+    def _do_put(self, event):
+        """ counts the finished product, there is always space in the sink """
+        product = event.item
+        lateness = 0 if product.due_date is None else max(0, self._env.now - product.due_date)
+
+        self.total_completed += 1
+        self.completed[product.product_type] += 1
+        if lateness > 0:
+            self.late[product.product_type] += 1
+            self.total_lateness[product.product_type] += lateness
+
+        order = product.order
+        order.finished_products += 1
+        if lateness > 0:
+            order.late_products += 1
+            order.total_lateness += lateness
+        if order.finished_products == len(order.products):
+            self.completed_orders += 1
+            if lateness > 0:
+                self.late_orders += 1
+                self.total_order_lateness += lateness
+            del self.orders[order.id]
+
+        if self.retain_products:
+            self.items.append(product)
+        event.succeed()
@@ -1,9 +1,13 @@
 import logging
 import simpy
 
+from sim.TickEnvironment import TickEnvironment
 from sim.Machine import Machine
+from sim.MachineKPIs import MachineKPIs
 from sim.Schedule import Schedule
 from sim.Clock import Clock
+from sim.SinkStore import SinkStore
+from sim.MaintenanceDispatcher import MaintenanceDispatcher
 from sim.OrderGenerator import OrderGenerator
 
 
@@ -14,10 +18,12 @@ class System():
     # :param maintenance costs: dict,  of costs by job type
     """
 
-    def __init__(self, use_case, production_system):
-        ''' Sets up the general system structure. Supposed to be called exactly once at the beginning of training.'''
+    def __init__(self, use_case, production_system, plant=None):
+        ''' Sets up the general system structure. Supposed to be called exactly once at the beginning of training.
+        If a Plant is given, this system is one of its lines and shares its simulation and maintenance resources.'''
         
         self.logger = logging.getLogger("factory_sim")
+        self.plant = plant
         
         # use case: 'ih'
         self.use_case = use_case
@@ -44,12 +50,15 @@ class System():
         
         # maximum number of simultaneous maintenance processes
         self.maintenance_capacity = self.production_system.maintenance_capacity
+        # order of the maintenance requests, see MaintenanceDispatcher.PRIORITIES
+        self.maintenance_priority = 'request_time'
+        # health from which the machines request CBM, dict {machine_id: threshold} (None: 6 for all machines)
+        self.cbm_thresholds = None
         
         # simulation parameters
         self.simulation_time = 400
-        
-        # part of a timestep which delays or prepones parts of the simulation
-        self.epsilon = 0.00001
+        # keep the finished products in the sink_store (otherwise only counters per product type and order)
+        self.retain_finished_products = False
         
         # schedule/shift parameters
         # unit here is one hour, initial hour 0 is 6 o'clock on monday
@@ -74,7 +83,7 @@ class System():
         """ Initializes the system for simulation. New simpy.Environment per simulation is needed.
         This method is supposed to be called in the SimEnv.reset(), every time a new episode starts."""
         
-        self.sim_env = simpy.Environment()
+        self.sim_env = TickEnvironment() if self.plant is None else self.plant.sim_env
         
         # initialize weekly Schedule
         self.weekly_schedule = Schedule(self.sim_env, self.step_duration, self.work_start_mon, self.work_end_sat, weekend_on=self.weekend_on)
@@ -83,26 +92,40 @@ class System():
             # initialize Clock
             self.clock = Clock('C0', self, self.step_duration)
         
-        # at the start of the simulation, all maintenance resources are available
-        self.available_maintenance = self.maintenance_capacity
-
-        # for FIFO list of all machines that want to be repaired
-        self.machines_to_repair = []
+        # queue of the maintenance requests and the maintenance crews, in a plant shared by all lines
+        if self.plant is None:
+            self.dispatcher = MaintenanceDispatcher(self.sim_env, self.maintenance_capacity, priority=self.maintenance_priority)
+        else:
+            self.dispatcher = self.plant.dispatcher
         
         # set up filtered stores as source, items in production (output buffers) and sink
         self.source_store = simpy.FilterStore(env=self.sim_env, capacity=float('inf'))
         self.production_store = simpy.FilterStore(env=self.sim_env, capacity=self.store_capacity)
-        self.sink_store = simpy.FilterStore(env=self.sim_env, capacity=float('inf'))
+        # open orders by id (in the order of their arrival), finished orders are removed by the sink_store in O(1)
+        # and only kept in its counters
+        self.orders = {}
+        self.order_counter = 0
+        self.sink_store = SinkStore(env=self.sim_env, product_types=self.production_system.product_types, orders=self.orders,
+                                    retain_products=self.retain_finished_products)
         
         # generate products or process to create products
-        self.orders = []
         self.order_generator = OrderGenerator(system=self, order_type=self.order_type,
                         order_probability_step=self.order_probability_step, order_list = self.order_list, items_per_type = self.items_per_type)
         
+        # KPIs of the machines, updated by their status changes
+        self.kpis = MachineKPIs(self.sim_env)
+        
         # infere the jobshop layout
         self.machines = []
+        self.machines_by_id = {}
         for m in self.job_shop_machine.keys():
             machine=Machine(id=self.job_shop_machine[m]["id"], system=self, machine_type = self.job_shop_machine[m]["machine_type"],
                     output_buffer_capacity=self.job_shop_machine[m]["output_buffer_capacity"])
             self.machines.append(machine)
-        
\ No newline at end of file
+            self.machines_by_id[machine.id] = machine
+        
+
+    @property
+    def available_maintenance(self):
+        """ free maintenance resources, the ones of the plant if this system is a line of a Plant """
+        return self.dispatcher.available
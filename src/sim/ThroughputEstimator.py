@@ -0,0 +1,218 @@
+import math
+import numpy as np
+
+
+class ThroughputEstimator():
+    """
+    Analytic estimate of throughput and downtime of a serial line, to screen many line configurations
+    without simulating them. All methods are vectorized over configurations: parameters are arrays of
+    shape (n_configs, n_machines), buffer_capacities of shape (n_configs, n_machines-1).
+
+    The estimate combines three approximations that are iterated to a fixed point:
+    - maintenance cycle per machine: degradation while working until the CBM threshold is reached,
+      waiting for a crew (the machine keeps working and may fail meanwhile), cbm or cm repair
+    - waiting time for a crew: finite-source queue (machine repairman model) of the maintenance requests,
+      scaled by the variability of requests and repairs (Allen-Cunneen, requests superposed as in QNA)
+    - line throughput: each machine is an unreliable machine with geometric up and down times,
+      the line is aggregated from the first machine on by solving two-machine lines with a finite
+      buffer as continuous flow Markov chains (decomposition by aggregation)
+    """
+    def __init__(self, CBM_threshold=6, dim=10, iterations=10, tolerance=1e-3, cells_per_part=1):
+        # same defaults as Machine
+        self.CBM_threshold = CBM_threshold
+        self.failed_state = dim-1
+        self.iterations = iterations
+        self.tolerance = tolerance
+        # resolution of the buffer levels in the two-machine lines
+        self.cells_per_part = cells_per_part
+
+    def get_parameters(self, production_system):
+        """
+        Reads the parameters of a serial line from a ProductionSystem, machines in order of the tasks
+        :return: dict of arrays with shape (1, n_machines) (buffer_capacities: (1, n_machines-1)) and maintenance_capacity
+        """
+        assert len(production_system.product_types) == 1, 'Tried to estimate a line with {} product types, only serial lines with one product type are supported.'.format(len(production_system.product_types))
+        tasks = production_system.tasks_for_product[production_system.product_types[0]]
+
+        machines = []
+        for task in tasks:
+            machines.append([m for m in production_system.job_shop_machine.values() if task in production_system.machine_types[m['machine_type']]['tasks']])
+            assert len(machines[-1]) == 1, 'Tried to estimate a line where task {} can be done by {} machines.'.format(task, len(machines[-1]))
+        machines = [m[0] for m in machines]
+        machine_types = [production_system.machine_types[m['machine_type']] for m in machines]
+
+        return {
+            'process_times': np.array([[machine_type['tasks'][task] for task, machine_type in zip(tasks, machine_types)]], dtype=float),
+            'buffer_capacities': np.array([[m['output_buffer_capacity'] for m in machines[:-1]]], dtype=float),
+            'degradation_rates': np.array([[machine_type['degradation_rate'] for machine_type in machine_types]], dtype=float),
+            'cbm_durations': np.array([[machine_type['repair_durations']['cbm'] for machine_type in machine_types]], dtype=float),
+            'cm_durations': np.array([[machine_type['repair_durations']['cm'] for machine_type in machine_types]], dtype=float),
+            'maintenance_capacity': np.array([production_system.maintenance_capacity]),
+            }
+
+    def estimate_production_system(self, production_system, simulation_time=400):
+        """
+        Estimate for a single ProductionSystem, returns a dict of scalars/lists
+        """
+        estimate = self.estimate(**self.get_parameters(production_system))
+        estimate = {key: value[0].tolist() for key, value in estimate.items()}
+        estimate['parts'] = estimate['throughput'] * simulation_time
+        return estimate
+
+    def estimate(self, process_times, buffer_capacities, degradation_rates, cbm_durations, cm_durations, maintenance_capacity):
+        """
+        Estimates throughput (parts per time step), availability and downtime of each machine (share of time steps),
+        probability of a corrective repair per maintenance cycle and the waiting time for a crew
+        :return: dict of arrays
+        """
+        process_times = np.atleast_2d(process_times)
+        n_configs, n_machines = process_times.shape
+        buffer_capacities = np.broadcast_to(buffer_capacities, (n_configs, n_machines-1))
+        degradation_rates = np.broadcast_to(degradation_rates, (n_configs, n_machines))
+        cbm_durations = np.broadcast_to(cbm_durations, (n_configs, n_machines))
+        cm_durations = np.broadcast_to(cm_durations, (n_configs, n_machines))
+        maintenance_capacity = np.broadcast_to(maintenance_capacity, (n_configs,))
+
+        # share of the up time a machine is working (not starved or blocked), degradation only happens while working
+        working = np.ones((n_configs, n_machines))
+        waiting_time = np.zeros(n_configs)
+        for iteration in range(self.iterations):
+            up_time, down_time, cycle_scv, p_cm = self._get_maintenance_cycle(working, waiting_time[:, None], degradation_rates, cbm_durations, cm_durations)
+            request_time = self.CBM_threshold / (degradation_rates * working)
+            waiting_time = self._get_waiting_time(request_time, cycle_scv, p_cm, cbm_durations, cm_durations, maintenance_capacity)
+            availability = up_time / (up_time + down_time)
+            throughput = self._get_line_throughput(1 / process_times, 1 / up_time, 1 / down_time, buffer_capacities)
+            # damped update, more throughput means faster degradation and vice versa
+            previous = working
+            working = 0.5 * working + 0.5 * np.clip(throughput[:, None] * process_times / availability, 1e-6, 1)
+            if np.abs(working - previous).max() < self.tolerance:
+                break
+
+        return {
+            'throughput': throughput,
+            'availability': availability,
+            'downtime': 1 - availability,
+            'utilization': working * availability,
+            'p_cm': p_cm,
+            'waiting_time': waiting_time,
+            }
+
+    def _get_maintenance_cycle(self, working, waiting_time, degradation_rates, cbm_durations, cm_durations):
+        """
+        Mean up time and down time of one maintenance cycle, squared coefficient of variation of its length
+        and the probability that the machine fails
+        """
+        # degradation steps per time step while up
+        rate = degradation_rates * working
+        steps_to_fail = self.failed_state - self.CBM_threshold
+        # degradation steps during the wait are approximately poisson distributed
+        mean_steps = rate * waiting_time
+        p_cm = 1 - np.exp(-mean_steps) * sum(mean_steps**k / math.factorial(k) for k in range(steps_to_fail))
+        # a machine fails on average halfway through the wait and is down for the rest of it
+        residual_wait = 0.5 * waiting_time
+
+        up_time = self.CBM_threshold / rate + waiting_time - p_cm * residual_wait
+        down_time = p_cm * (residual_wait + cm_durations) + (1 - p_cm) * cbm_durations
+        # the time until the CBM threshold is reached varies most, each degradation step takes a geometric number of steps
+        variance = self.CBM_threshold * (1 - degradation_rates) / rate**2
+        cycle_scv = variance / (up_time + down_time)**2
+        return up_time, down_time, cycle_scv, p_cm
+
+    def _get_waiting_time(self, request_times, cycle_scv, p_cm, cbm_durations, cm_durations, maintenance_capacity):
+        """
+        Mean waiting time for a crew, machine repairman model with exponential times scaled by the variability of the
+        requests and repairs
+        :param request_times: time from the end of a repair until the next request of each machine
+        """
+        n_configs, n_machines = request_times.shape
+        request_rate = (1 / request_times).mean(axis=1)
+        share = (1 / request_times) / (1 / request_times).sum(axis=1, keepdims=True)
+        # repairs are cbm or cm
+        service_time = (share * (p_cm * cm_durations + (1 - p_cm) * cbm_durations)).sum(axis=1)
+        service_scv = (share * (p_cm * cm_durations**2 + (1 - p_cm) * cbm_durations**2)).sum(axis=1) / service_time**2 - 1
+
+        # birth-death process of the number of machines waiting or under repair
+        k = np.arange(n_machines + 1)
+        c = maintenance_capacity[:, None]
+        births = (n_machines - k[None, :]) * request_rate[:, None]
+        deaths = np.minimum(k[None, :], c) / service_time[:, None]
+        p = np.cumprod(np.concatenate([np.ones((n_configs, 1)), births[:, :-1] / deaths[:, 1:]], axis=1), axis=1)
+        p /= p.sum(axis=1, keepdims=True)
+        queue_length = (np.maximum(k[None, :] - c, 0) * p).sum(axis=1)
+        arrival_rate = (births * p).sum(axis=1)
+        load = np.minimum(arrival_rate * service_time / maintenance_capacity, 1)
+
+        # QNA: superposition of the requests, a few regular sources are more regular than poisson arrivals
+        weight = 1 / (1 + 4 * (1 - load)**2 * (1 / (share**2).sum(axis=1) - 1))
+        arrival_scv = weight * (share * cycle_scv).sum(axis=1) + 1 - weight
+        return 0.5 * (arrival_scv + service_scv) * queue_length / arrival_rate
+
+    def _get_line_throughput(self, rates, p_fail, p_repair, buffer_capacities):
+        """
+        Throughput of the line, aggregates the machines from the first one on: the first machines are replaced by
+        an equivalent machine with the repair probability of the last one and the throughput of their two-machine line
+        """
+        p_fail = np.clip(p_fail, 0, 1)
+        p_repair = np.clip(p_repair, 0, 1)
+        rate, fail, repair = rates[:, 0], p_fail[:, 0], p_repair[:, 0]
+        throughput = rate * repair / (repair + fail)
+        for n in range(1, rates.shape[1]):
+            throughput = self._get_two_machine_throughput(rate, fail, repair, rates[:, n], p_fail[:, n], p_repair[:, n], buffer_capacities[:, n-1])
+            # equivalent machine with the same isolated throughput, starvation counts as down time
+            rate, repair = rates[:, n], p_repair[:, n]
+            availability = np.clip(throughput / rate, 1e-6, 1)
+            fail = np.clip(repair * (1 - availability) / availability, 0, 1)
+        return throughput
+
+    def _get_two_machine_throughput(self, rate1, fail1, repair1, rate2, fail2, repair2, capacity):
+        """
+        Throughput of a two-machine line with deterministic processing rates and continuous material flow, solved as
+        quasi birth-death Markov chain with phases (up1, up2) and the buffer level in cells of 1/cells_per_part parts.
+        The part held by a blocked machine counts to the buffer, so capacity+1 parts fit between the machines.
+        An infinite capacity decouples the machines.
+        """
+        throughput = np.minimum(rate1 * repair1 / (repair1 + fail1), rate2 * repair2 / (repair2 + fail2))
+        config = np.isfinite(capacity)
+        if not config.any():
+            return throughput
+        g = self.cells_per_part
+        r1, p1, q1 = rate1[config], fail1[config], repair1[config]
+        r2, p2, q2 = rate2[config], fail2[config], repair2[config]
+        up = np.array([0, 0, 1, 1]), np.array([0, 1, 0, 1])
+
+        # phase transitions within 1/g time steps, index 0: down, 1: up
+        status1 = np.stack([np.stack([1 - q1/g, q1/g], -1), np.stack([p1/g, 1 - p1/g], -1)], 1)
+        status2 = np.stack([np.stack([1 - q2/g, q2/g], -1), np.stack([p2/g, 1 - p2/g], -1)], 1)
+        phases = np.einsum('bik,bjl->bijkl', status1, status2).reshape(-1, 4, 4)
+
+        # the buffer level moves by one cell with the probability of the net flow in parts per time step
+        flow = r1[:, None] * up[0] - r2[:, None] * up[1]
+        increase = np.clip(flow, 0, 1)[..., None] * phases
+        decrease = np.clip(-flow, 0, 1)[..., None] * phases
+        stay = (1 - np.abs(flow))[..., None] * phases
+        eye = np.eye(4)
+
+        # linear level reduction from the full buffer down to the empty one, pi_k = pi_k-1 R_k,
+        # all configurations at once, levels above the full buffer of a configuration are not used
+        levels = (g * (capacity[config] + 1)).astype(int)
+        full = increase @ np.linalg.inv(eye - stay - increase)
+        R = [full]
+        for level in range(levels.max() - 1, 0, -1):
+            # full buffer, the level can not increase
+            R.append(np.where((level == levels)[:, None, None], full, increase @ np.linalg.inv(eye - stay - R[-1] @ decrease)))
+        R = R[::-1]
+
+        # empty buffer, the level can not decrease
+        empty = stay + decrease + R[0] @ decrease - eye
+        empty[:, :, -1] = 1
+        rhs = np.zeros((len(r1), 4))
+        rhs[:, -1] = 1
+        pi = [np.linalg.solve(np.swapaxes(empty, 1, 2), rhs[..., None])[..., 0]]
+        for level in range(levels.max()):
+            pi.append(np.where((level < levels)[:, None], np.einsum('bi,bij->bj', pi[-1], R[level]), 0))
+        pi = np.stack(pi, 1)
+        pi /= pi.sum(axis=(1, 2), keepdims=True)
+
+        # the second machine passes on what the first one delivers if the buffer is empty
+        throughput[config] = r2 * pi[:, 1:, 1::2].sum(axis=(1, 2)) + np.minimum(r1, r2) * pi[:, 0, 3]
+        return throughput
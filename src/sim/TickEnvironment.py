@@ -0,0 +1,67 @@
+import simpy
+from simpy.events import Event
+
+
+# Phases of one tick in the order they are processed. They are used as event priorities, simpy itself uses
+# 0 for urgent and 1 for normal events, so events triggered during a phase are processed before the next phase starts.
+# The agent decides between two ticks, i.e. after the repair phase of the previous tick. Finished tasks are handed
+# over in the production phase at the start of the following tick, so the agent sees a product in the machine that
+# has just finished it, as it did with the former epsilon offsets. Products are put into the output buffers and
+# picked up from them in the assignment phase, after all machines of the tick checked their output buffer, so space
+# freed in a tick is only seen in the next one, as with the former polling.
+PHASE_DECISION = 1
+PHASE_CLOCK = 2
+PHASE_ARRIVAL = 3
+PHASE_PRODUCTION = 4
+PHASE_ASSIGNMENT = 5
+PHASE_DEGRADE = 6
+PHASE_REPAIR = 7
+
+
+class PhaseTimeout(Event):
+    """
+    Timeout which ends in a given phase of the tick now + delay.
+    """
+    def __init__(self, env, delay, phase, value=None):
+        if delay < 0:
+            raise ValueError('Negative delay {}'.format(delay))
+        super().__init__(env)
+        self.phase = phase
+        self._delay = delay
+        self._ok = True
+        self._value = value
+        # enter the phase before the waiting process is resumed
+        self.callbacks.append(env.enter_phase)
+        env.schedule(self, phase, delay)
+
+
+class TickEnvironment(simpy.Environment):
+    """
+    simpy.Environment with integer time (ticks). Within one tick, events are processed in a fixed order of phases:
+    clock -> order arrival -> production -> assignment -> degradation -> repair completion, followed by the decision of the agent.
+    """
+    def __init__(self, initial_time=0):
+        super().__init__(initial_time)
+        # processes started before the first tick are started in the decision phase
+        self.phase = PHASE_DECISION
+
+    def enter_phase(self, event):
+        """ callback of PhaseTimeout, sets the phase that is currently processed """
+        self.phase = event.phase
+
+    def run(self, until=None):
+        """ runs the simulation, afterwards the agent decides (until the next run) """
+        try:
+            return super().run(until)
+        finally:
+            self.phase = PHASE_DECISION
+
+    def timeout_phase(self, delay, phase, value=None):
+        """ returns an event that occurs in the given phase of the tick now + delay """
+        return PhaseTimeout(self, delay, phase, value)
+
+    def phase_tick(self, phase):
+        """ returns the tick in which the given phase is processed next, the current tick if it is not over yet """
+        if self.phase <= phase:
+            return self.now
+        return self.now + 1
@@ -0,0 +1,160 @@
+import os
+import json
+import math
+import random
+import logging
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+
+# search space of the DDQN hyperparameters of train_agent.py, lists are sampled uniformly,
+# tuples (low, high) log-uniformly and rounded to int if both bounds are ints
+SEARCH_SPACE = {
+    'n_hidden1': [14, 28, 64],
+    'n_hidden2': [28, 64, 128],
+    'start_learning': [97],
+    'batch_sz': [32, 64, 137, 256],
+    'gamma': [0.95, 0.99, 0.993],
+    'lr': (0.00005, 0.005),
+    'target_update_iter': (10, 200),
+    'epsilon_decay': (0.000005, 0.0001),
+    'epsilon': [0.2, 0.5, 1.0],
+    'min_epsilon': [0.01, 0.05, 0.1],
+    'buffer_sz': [10000, 100000],
+}
+
+
+def sample_config(search_space, rng):
+    """ samples one set of hyperparameters from the search space """
+    config = {}
+    for name, space in search_space.items():
+        if isinstance(space, tuple):
+            low, high = space
+            value = math.exp(rng.uniform(math.log(low), math.log(high)))
+            config[name] = int(round(value)) if isinstance(low, int) and isinstance(high, int) else value
+        else:
+            config[name] = rng.choice(space)
+    return config
+
+
+def run_trial(config, production_system, epochs, checkpoint_path, seed):
+    """
+    Trains a DDQNAgent with the given hyperparameters up to epochs (continues from its checkpoint)
+    :return: last ep_rewards_mean (mean reward of the last 100 episodes)
+    """
+    # imported in the worker, the scheduler itself does not need torch
+    import numpy as np
+    import torch
+    from SimEnv_IH import SimEnvIH
+    from sim.System import System
+    from sim import ProductionExamples
+    from agent.DDQN import DQNModel, DDQNAgent
+
+    # one thread per worker, the pool already uses all cores
+    torch.set_num_threads(1)
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+
+    system = System(use_case = "ih", production_system = getattr(ProductionExamples, production_system)())
+    env = SimEnvIH(system)
+    env.action_space.seed(seed)
+    env_dims = env.system_state_converter.get_observation_dims()
+    action_dims = env.action_space.n
+
+    model = DQNModel(n_actions=action_dims, env_dims=env_dims, n_hidden1=config['n_hidden1'], n_hidden2=config['n_hidden2'])
+    target_model = DQNModel(n_actions=action_dims, env_dims=env_dims, n_hidden1=config['n_hidden1'], n_hidden2=config['n_hidden2'])
+    agent = DDQNAgent(env=env, model=model, target_model=target_model,
+                      start_learning=config['start_learning'], target_update_iter=config['target_update_iter'],
+                      gamma=config['gamma'], buffer_sz=config['buffer_sz'], epsilon_decay=config['epsilon_decay'],
+                      epsilon=config['epsilon'], min_epsilon=config['min_epsilon'], lr=config['lr'])
+
+    _, _, ep_rewards_mean = agent.train(epochs=epochs, batch_sz=config['batch_sz'], checkpoint_path=checkpoint_path, checkpoint_iter=epochs)
+    return float(ep_rewards_mean[-1])
+
+
+class SuccessiveHalving():
+    """
+    Hyperparameter sweep with successive halving: all trials are trained for min_epochs, the best 1/eta of them
+    are trained further for eta times as many epochs (continuing from their checkpoints), until max_epochs.
+    Results are written to path/results.json after each finished run, an interrupted sweep resumes from there.
+    """
+    def __init__(self, path, search_space=SEARCH_SPACE, n_trials=27, min_epochs=100, max_epochs=3000, eta=3,
+                 production_system='ProductionSystem1', workers=None, seed=0):
+        self.logger = logging.getLogger("factory_sim")
+        self.path = path
+        self.results_path = os.path.join(self.path, 'results.json')
+        self.eta = eta
+        self.production_system = production_system
+        self.workers = workers or os.cpu_count()
+        os.makedirs(self.path, exist_ok=True)
+
+        # epochs of each rung
+        self.rungs = [min_epochs]
+        while self.rungs[-1] < max_epochs:
+            self.rungs.append(min(self.rungs[-1] * eta, max_epochs))
+
+        if os.path.exists(self.results_path):
+            with open(self.results_path) as f:
+                self.trials = json.load(f)
+            self.logger.info('Resuming sweep with {} trials from {}'.format(len(self.trials), self.results_path), extra = {'simtime': 0})
+        else:
+            rng = random.Random(seed)
+            self.trials = [{'id': trial, 'seed': seed + trial, 'config': sample_config(search_space, rng), 'rewards': {}}
+                           for trial in range(n_trials)]
+            self._save()
+
+    def _save(self):
+        """ writes the results, via a temporary file to not corrupt them if the process dies while saving """
+        with open(self.results_path + '.tmp', 'w') as f:
+            json.dump(self.trials, f, indent=1)
+        os.replace(self.results_path + '.tmp', self.results_path)
+
+    def run(self):
+        """
+        Runs the sweep
+        :return: the best trial (dict with id, seed, config and the rewards per rung)
+        """
+        survivors = self.trials
+        for rung, epochs in enumerate(self.rungs):
+            # run what is missing of this rung
+            missing = [trial for trial in survivors if str(epochs) not in trial['rewards']]
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                futures = {executor.submit(run_trial, trial['config'], self.production_system, epochs,
+                                           os.path.join(self.path, 'trial{:03d}.pt'.format(trial['id'])), trial['seed']): trial
+                           for trial in missing}
+                for future in as_completed(futures):
+                    trial = futures[future]
+                    trial['rewards'][str(epochs)] = future.result()
+                    self._save()
+                    self.logger.info('Trial {} after {} epochs: ep_rewards_mean {:.3f}'.format(trial['id'], epochs, trial['rewards'][str(epochs)]),
+                                     extra = {'simtime': 0})
+
+            # keep the best 1/eta trials for the next rung
+            survivors = sorted(survivors, key=lambda trial: trial['rewards'][str(epochs)], reverse=True)
+            if rung < len(self.rungs) - 1:
+                survivors = survivors[:max(1, len(survivors) // self.eta)]
+
+        best = survivors[0]
+        self.logger.info('Best trial {} with ep_rewards_mean {:.3f}: {}'.format(best['id'], best['rewards'][str(self.rungs[-1])], best['config']),
+                         extra = {'simtime': 0})
+        return best
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(simtime)6d %(message)s')
+
+    parser = argparse.ArgumentParser(description='Successive halving sweep over the DDQN hyperparameters')
+    parser.add_argument('path', help='directory for checkpoints and results.json, an existing sweep is resumed')
+    parser.add_argument('--trials', type=int, default=27)
+    parser.add_argument('--min-epochs', type=int, default=100)
+    parser.add_argument('--max-epochs', type=int, default=3000)
+    parser.add_argument('--eta', type=int, default=3)
+    parser.add_argument('--production-system', default='ProductionSystem1')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    sweep = SuccessiveHalving(args.path, n_trials=args.trials, min_epochs=args.min_epochs, max_epochs=args.max_epochs, eta=args.eta,
+                              production_system=args.production_system, workers=args.workers, seed=args.seed)
+    sweep.run()
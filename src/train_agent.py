@@ -1,10 +1,9 @@
 import logging
-import matplotlib.pyplot as plt
 
 from SimEnv_IH import SimEnvIH
 from sim.System import System
 from sim.ProductionExamples import ProductionSystem1, ProductionSystem2
-from agent.DDQN import DQNModel, DDQNAgent
+from agent.DDQN import DQNModel, FactoredDQNModel, DDQNAgent
 from agent.Heuristics import RandomAgent, FIFOAgent
 
 
@@ -15,7 +14,8 @@ if __name__ == "__main__":
 
     # create environment
     system = System(use_case = "ih", production_system = ProductionSystem1())
-    env = SimEnvIH(system)
+    # with more than one maintenance crew, assign all crews in one step
+    env = SimEnvIH(system, multi_crew=system.maintenance_capacity > 1)
 
     # Hyperparameters
     n_hidden1=14
@@ -37,14 +37,25 @@ env_dims = env.system_state_converter.get_observation_dims()
 action_dims = env.action_space.n
 
 
-model = DQNModel(n_actions=action_dims,
-                env_dims=env_dims,
-                n_hidden1=n_hidden1,
-                n_hidden2=n_hidden2)
-target_model = DQNModel(n_actions=action_dims,
-                env_dims=env_dims,
-                n_hidden1=n_hidden1,
-                n_hidden2=n_hidden2)
+if env.multi_crew:
+    # one branch per machine
+    model = FactoredDQNModel(n_branches=action_dims,
+                    env_dims=env_dims,
+                    n_hidden1=n_hidden1,
+                    n_hidden2=n_hidden2)
+    target_model = FactoredDQNModel(n_branches=action_dims,
+                    env_dims=env_dims,
+                    n_hidden1=n_hidden1,
+                    n_hidden2=n_hidden2)
+else:
+    model = DQNModel(n_actions=action_dims,
+                    env_dims=env_dims,
+                    n_hidden1=n_hidden1,
+                    n_hidden2=n_hidden2)
+    target_model = DQNModel(n_actions=action_dims,
+                    env_dims=env_dims,
+                    n_hidden1=n_hidden1,
+                    n_hidden2=n_hidden2)
 
 agent = DDQNAgent(env=env,
                 model=model,